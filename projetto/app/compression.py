@@ -0,0 +1,122 @@
+import gzip
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Сжимаем только JSON API. HTML (админка, формы DRF) не сжимается: в нём CSRF-токен рядом с данными
+# из запроса, сжатие таких страниц открывает BREACH. Картинки, PDF и архивы уже сжаты
+COMPRESSIBLE_TYPES = ('application/json',)
+
+# Уровни сжатия: на лету - быстрее, для кэша (сжимается один раз) - сильнее
+DYNAMIC_LEVELS = {'br': 5, 'gzip': 6}
+CACHED_LEVELS = {'br': 9, 'gzip': 9}
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compress(content, encoding, levels=DYNAMIC_LEVELS):
+    if encoding == 'br':
+        return brotli.compress(content, quality=levels['br'])
+    # mtime=0 - одинаковый результат для одинакового содержимого
+    return gzip.compress(content, compresslevel=levels['gzip'], mtime=0)
+
+
+def choose_encoding(request, encodings):
+    """Лучшее из encodings, которое принимает клиент по Accept-Encoding, или None"""
+    accepted = {}
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name.strip():
+            accepted[name.strip().lower()] = quality
+
+    for encoding in encodings:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def is_compressible(content_type):
+    return content_type.split(';')[0].strip().lower().startswith(COMPRESSIBLE_TYPES)
+
+
+def precompress(content, content_type):
+    """Варианты ответа для кэша: {'identity': ..., 'gzip': ..., 'br': ...}"""
+    variants = {'identity': content}
+    if len(content) >= settings.COMPRESSION_MIN_SIZE and is_compressible(content_type):
+        for encoding in available_encodings():
+            variants[encoding] = compress(content, encoding, CACHED_LEVELS)
+    return variants
+
+
+def precompressed_response(request, variants, content_type):
+    """HttpResponse из заранее сжатых вариантов; CompressionMiddleware такой ответ повторно не сжимает"""
+    encoding = choose_encoding(request, [encoding for encoding in available_encodings() if encoding in variants])
+    response = HttpResponse(variants[encoding or 'identity'], content_type=content_type)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    if len(variants) > 1:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+class CompressionMiddleware:
+    """
+    Сжатие JSON-ответов brotli (если установлен) или gzip по Accept-Encoding.
+    Не трогает потоковые ответы (файлы, Range, SSE), уже сжатые и меньше COMPRESSION_MIN_SIZE.
+    Работает и под WSGI, и под ASGI (асинхронные view не переключаются в поток).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if len(response.content) < settings.COMPRESSION_MIN_SIZE or not is_compressible(response.get('Content-Type', '')):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request, available_encodings())
+        if encoding is None:
+            return response
+
+        compressed = compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(response.content))
+        response['Content-Encoding'] = encoding
+        # Сжатое тело отличается побайтно, поэтому сильный ETag становится слабым
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,69 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.filters import OrderingFilter, SearchFilter
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """Курсорная пагинация: без COUNT(*) и OFFSET, позиция берётся по индексированному полю"""
+    ordering = '-id'
+
+    def __init__(self, ordering=None):
+        if ordering:
+            self.ordering = ordering
+
+
+class HybridPagination(PageNumberPagination):
+    """
+    По умолчанию обычная постраничная пагинация (для админских клиентов).
+    ?pagination=cursor или ?cursor=... переключают на курсорную,
+    порядок задаётся атрибутом cursor_ordering у view.
+
+    Курсор держится только на порядке cursor_ordering, поэтому вместе с ?search= или ?ordering=
+    (ранг поиска, порядок по запросу) курсорный режим отклоняется с 400 - для них есть ?page=.
+    """
+    mode_query_param = 'pagination'
+    cursor_query_param = 'cursor'
+
+    def __init__(self, cursor_ordering=None):
+        self.cursor_ordering = cursor_ordering
+        self.cursor_paginator = None
+
+    def is_cursor_mode(self, request):
+        return request.query_params.get(self.mode_query_param) == 'cursor' \
+            or self.cursor_query_param in request.query_params
+
+    def ordered_by_filter(self, request, view):
+        """Параметр ?search=/?ordering=, который задаёт порядок через фильтры view, или None"""
+        for backend in getattr(view, 'filter_backends', ()):
+            if issubclass(backend, SearchFilter) and request.query_params.get(backend.search_param):
+                return backend.search_param
+            if issubclass(backend, OrderingFilter) and request.query_params.get(backend.ordering_param):
+                return backend.ordering_param
+        return None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.is_cursor_mode(request):
+            param = self.ordered_by_filter(request, view)
+            if param is not None:
+                raise ParseError(f'{param} is not supported with cursor pagination, use page pagination.')
+            ordering = self.cursor_ordering or getattr(view, 'cursor_ordering', None)
+            self.cursor_paginator = KeysetPagination(ordering)
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class OptionalHybridPagination(HybridPagination):
+    """
+    HybridPagination для списков, которые клиенты получают целиком: без ?page=, ?pagination=cursor
+    и ?cursor= ответ остаётся простым списком, с ними - постраничным или курсорным.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_cursor_mode(request) and self.page_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
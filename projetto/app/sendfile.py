@@ -0,0 +1,153 @@
+import mimetypes
+import posixpath
+import re
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.http import Http404, HttpResponse, FileResponse, StreamingHttpResponse
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import cached_property
+from django.utils.http import content_disposition_header, http_date
+
+# Размер куска при потоковом чтении из хранилища
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class ProtectedStorageMixin:
+    """Файлы в PROTECTED_MEDIA_ROOT: по /media/ недоступны, url() - путь internal-location SENDFILE_URL"""
+
+    @cached_property
+    def base_location(self):
+        return self._value_or_setting(self._location, settings.PROTECTED_MEDIA_ROOT)
+
+    @cached_property
+    def base_url(self):
+        if self._base_url is not None and not self._base_url.endswith('/'):
+            self._base_url += '/'
+        return self._value_or_setting(self._base_url, settings.SENDFILE_URL)
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting == 'PROTECTED_MEDIA_ROOT':
+            self.__dict__.pop('base_location', None)
+            self.__dict__.pop('location', None)
+        elif setting == 'SENDFILE_URL':
+            self.__dict__.pop('base_url', None)
+
+
+@deconstructible
+class ProtectedStorage(ProtectedStorageMixin, FileSystemStorage):
+    pass
+
+
+protected_storage = ProtectedStorage()
+
+
+def parse_range(header, size):
+    """
+    'bytes=0-99' -> (0, 99), 'bytes=-500' -> последние 500 байт.
+    None - заголовок не разобран или диапазонов несколько, тогда файл отдаётся целиком.
+    Если start >= size, диапазон невыполним (416).
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        return start, min(int(last), size - 1) if last else size - 1
+    if last:
+        suffix = int(last)
+        # 'bytes=-0' невыполним
+        return (max(size - suffix, 0) if suffix else size), size - 1
+    return None
+
+
+def file_chunks(file, start, length, chunk_size=CHUNK_SIZE):
+    """Читает length байт начиная со start кусками, не загружая файл в память целиком"""
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def serve_file(request, field_file, filename, as_attachment):
+    """FileResponse с поддержкой Range (206) для локальной отдачи"""
+    storage, name = field_file.storage, field_file.name
+    try:
+        size = storage.size(name)
+    except OSError:
+        # В базе имя есть, а файла нет (удалён или не перенесён) - 404, а не 500
+        raise Http404('File not found.')
+    try:
+        last_modified = http_date(storage.get_modified_time(name).timestamp())
+    except NotImplementedError:
+        last_modified = None
+
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    # If-Range: диапазон только если файл не менялся, иначе весь файл
+    if range_header and (not if_range or if_range == last_modified):
+        byte_range = parse_range(range_header, size)
+
+    if byte_range is None:
+        response = FileResponse(storage.open(name, 'rb'), as_attachment=as_attachment, filename=filename)
+        response.block_size = CHUNK_SIZE
+    else:
+        start, end = byte_range
+        if start >= size:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        content_type, _ = mimetypes.guess_type(filename)
+        response = StreamingHttpResponse(file_chunks(storage.open(name, 'rb'), start, end - start + 1), status=206,
+                                         content_type=content_type or 'application/octet-stream')
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+
+    response['Accept-Ranges'] = 'bytes'
+    if last_modified:
+        response['Last-Modified'] = last_modified
+    return response
+
+
+def sendfile(request, field_file, filename=None, as_attachment=True):
+    """
+    Отдаёт файл из FieldFile после проверки прав во view.
+    При SENDFILE_BACKEND = 'nginx' / 'xsendfile' Django отвечает только заголовками,
+    а байты (в том числе Range-запросы) передаёт фронтовой прокси;
+    'simple' - потоковый ответ с поддержкой Range для локальной разработки.
+    """
+    filename = filename or posixpath.basename(field_file.name)
+    backend = settings.SENDFILE_BACKEND
+
+    if backend == 'simple':
+        return serve_file(request, field_file, filename, as_attachment)
+
+    content_type, encoding = mimetypes.guess_type(filename)
+    response = HttpResponse(content_type=content_type or 'application/octet-stream')
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+
+    if backend == 'nginx':
+        # url() защищённых хранилищ указывает на internal-location SENDFILE_URL
+        response['X-Accel-Redirect'] = field_file.storage.url(field_file.name)
+    elif backend == 'xsendfile':
+        response['X-Sendfile'] = field_file.storage.path(field_file.name)
+    else:
+        raise ValueError(f'Unknown SENDFILE_BACKEND: {backend}')
+    return response
@@ -32,6 +32,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     # third party apps
     'drf_yasg',
     'rest_framework',
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'app.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -137,6 +139,9 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 STATIC_URL = 'static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+# Платные файлы (PDF планировок, договоры, пакеты проектов) лежат вне MEDIA_ROOT и не раздаются по /media/,
+# их отдают только проверяющие права view через app.sendfile
+PROTECTED_MEDIA_ROOT = os.getenv('PROTECTED_MEDIA_ROOT', os.path.join(BASE_DIR, 'protected'))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -160,7 +165,7 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.FormParser',
         'rest_framework.parsers.MultiPartParser'
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'app.pagination.HybridPagination',
     'PAGE_SIZE': 10
 }
 
@@ -239,8 +244,44 @@ redis_host = os.getenv('REDIS_HOST')
 redis_port = os.getenv('REDIS_PORT')
 redis_db = os.getenv('REDIS_DB')
 
-CELERY_BROKER_URL = f'redis://{redis_host}:{redis_port}/{redis_db}'
-CELERY_RESULT_BACKEND = f'redis://{redis_host}:{redis_port}/{redis_db}'
+REDIS_URL = f'redis://{redis_host}:{redis_port}/{redis_db}'
+
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
+
+# Общий (Redis) уровень кэша; без REDIS_HOST - кэш в памяти процесса для локальной разработки
+if redis_host:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'projetto',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Кэш ответов каталога: время жизни записи и размер LRU в памяти каждого воркера
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', 60 * 15))
+CATALOG_CACHE_LOCAL_SIZE = int(os.getenv('CATALOG_CACHE_LOCAL_SIZE', 512))
+
+# Ответы меньше этого размера (байт) не сжимаются
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+
+# Время жизни подписанных ссылок на файлы (секунд)
+SIGNED_URL_MAX_AGE = int(os.getenv('SIGNED_URL_MAX_AGE', 300))
+
+# Отдача защищённых файлов: 'nginx' (X-Accel-Redirect), 'xsendfile' (X-Sendfile, Apache/lighttpd) или 'simple' (сам Django)
+SENDFILE_BACKEND = os.getenv('SENDFILE_BACKEND', 'simple')
+# internal-location nginx, указывающий на PROTECTED_MEDIA_ROOT
+SENDFILE_URL = os.getenv('SENDFILE_URL', '/protected/')
+
+# Адрес сайта для абсолютных ссылок в ответах, которые собираются вне запроса (снимки дерева ЖК)
+SITE_URL = os.getenv('SITE_URL', f'https://{ALLOWED_HOSTS[0]}')
 
 USE_X_FORWARDED_HOST = True
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
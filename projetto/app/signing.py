@@ -0,0 +1,56 @@
+import math
+import time
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.http import Http404
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .sendfile import sendfile, protected_storage
+
+SIGNING_SALT = 'app.signing.file'
+# Срок действия округляется вверх до шага, чтобы в пределах шага все получали одинаковый URL (попадание в кэш CDN)
+EXPIRES_STEP = 60
+
+
+def file_signature(name, expires, filename):
+    return salted_hmac(SIGNING_SALT, f'{name}\n{expires}\n{filename}', algorithm='sha256').hexdigest()
+
+
+def sign_file_url(request, field_file, filename=None, max_age=None):
+    """
+    Короткоживущая ссылка на файл: /files/<name>?expires=<unix time>&filename=...&signature=<hmac>.
+    Проверяется без обращения к БД, поэтому её может отдавать прокси или CDN.
+    Возвращает (url, expires).
+    """
+    max_age = max_age or settings.SIGNED_URL_MAX_AGE
+    expires = math.ceil((time.time() + max_age) / EXPIRES_STEP) * EXPIRES_STEP
+    filename = filename or ''
+    query = {'expires': expires}
+    if filename:
+        query['filename'] = filename
+    query['signature'] = file_signature(field_file.name, expires, filename)
+    url = reverse('signed-file', kwargs={'name': field_file.name}) + '?' + urlencode(query)
+    return request.build_absolute_uri(url), expires
+
+
+def signed_file_view(request, name):
+    """Отдаёт файл по подписанной ссылке; просроченная или поддельная ссылка - 404"""
+    expires = request.GET.get('expires', '')
+    filename = request.GET.get('filename', '')
+    signature = request.GET.get('signature', '')
+    if not expires.isdigit() or int(expires) < time.time():
+        raise Http404('Link has expired.')
+    if not constant_time_compare(signature, file_signature(name, int(expires), filename)):
+        raise Http404('Invalid signature.')
+
+    # Подписываются только платные файлы, все они лежат в PROTECTED_MEDIA_ROOT
+    if not protected_storage.exists(name):
+        raise Http404('File not found.')
+    response = sendfile(request, SimpleNamespace(storage=protected_storage, name=name), filename=filename or None)
+    # Кэшировать можно ровно до истечения ссылки
+    patch_cache_control(response, public=True, max_age=max(int(expires) - int(time.time()), 0))
+    return response
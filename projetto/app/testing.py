@@ -0,0 +1,97 @@
+import io
+import shutil
+import tempfile
+from unittest import mock
+
+from PIL import Image
+from reportlab.pdfgen import canvas
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+
+from residence.cache import local_cache
+from residence.models import City, Residence, Cluster, Floor, Apartment, Layout
+from service.models import Order
+
+# Задачи Celery, которые сигналы каталога ставят после коммита
+SIGNAL_TASKS = ('rebuild_residence_tree', 'generate_image_variants', 'generate_tile_pyramid')
+
+
+class TemporaryMediaMixin:
+    """Общая подготовка тестов: файлы во временном каталоге, пустой кэш, задачи Celery из сигналов не ставятся"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(
+            MEDIA_ROOT=f'{cls.media_root}/media', PROTECTED_MEDIA_ROOT=f'{cls.media_root}/protected',
+            SENDFILE_BACKEND='simple')
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        local_cache.clear()
+        for task in SIGNAL_TASKS:
+            patcher = mock.patch(f'residence.signals.{task}')
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+def image_file(name='image.png', size=(800, 600)):
+    """PNG заданного размера для полей изображений"""
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 120, 40)).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+def pdf_file(name='layout.pdf', pages=1):
+    """PDF с pages страницами A4"""
+    buffer = io.BytesIO()
+    document = canvas.Canvas(buffer)
+    for page in range(pages):
+        document.drawString(100, 700, f'Страница {page + 1}')
+        document.showPage()
+    document.save()
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='application/pdf')
+
+
+def create_layout(**kwargs):
+    fields = {'name': 'A', 'variant': 1, 'room_number': 2, 'type_of_apartment': 'def', 'price': '100 000'}
+    fields.update(kwargs)
+    return Layout.objects.create(**fields)
+
+
+def create_tree(clusters=1, floors=1, apartments=1, title='ЖК'):
+    """ЖК с clusters пятнами, floors этажами в каждом и apartments квартирами на этаже"""
+    residence = Residence.objects.create(title=title, city=City.objects.get_or_create(name='Алматы')[0])
+    for cluster_index in range(clusters):
+        cluster = Cluster.objects.create(name=f'Блок {cluster_index}', residence_id=residence)
+        for floor_index in range(floors):
+            floor = Floor.objects.create(floor_numbers=str(floor_index + 1))
+            floor.clusters.add(cluster)
+            for apartment_index in range(apartments):
+                apartment = Apartment.objects.create(room_number=2, area=50, door_number=str(apartment_index), floor=floor)
+                apartment.layouts.add(create_layout())
+    return residence
+
+
+def create_order(user, **kwargs):
+    """Заказ с данными для титульного листа договора: ЖК, пятно, квартира и планировка"""
+    residence = create_tree(clusters=1, floors=0)
+    fields = {
+        'user': user,
+        'cluster': residence.clusters.get(),
+        'apartment': Apartment.objects.create(room_number=2, area=50),
+        'flat_layout': create_layout(),
+    }
+    fields.update(kwargs)
+    return Order.objects.create(**fields)
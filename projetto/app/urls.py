@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.urls import path, include, re_path
 from django.conf.urls.static import static
+from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.conf import settings
 
 from rest_framework import permissions
@@ -17,6 +18,10 @@ from service.views.user_views import UserViewSet
 from service.views.order_views import OrderViewSet
 from service.views.ticket_views import TicketViewSet, TicketAttachmentViewSet
 from service.views.freedom_views import FreedomCheckRequestViewSet, FreedomResultRequestViewSet
+from service.views.upload_views import UploadSessionViewSet
+from service.views.event_views import task_status_events
+
+from app.signing import signed_file_view
 
 from residence.views import ResidenceViewSet, AttachmentViewSet, ClusterViewSet, FloorViewSet, ApartmentViewSet, \
                             LayoutViewSet, CityViewSet
@@ -35,6 +40,7 @@ router.register(r'tickets', TicketViewSet)
 router.register(r'ticket_attachments', TicketAttachmentViewSet)
 router.register(r'freedom_check', FreedomCheckRequestViewSet)
 router.register(r'freedom_result', FreedomResultRequestViewSet)
+router.register(r'uploads', UploadSessionViewSet)
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -53,8 +59,13 @@ schema_view = get_schema_view(
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls')),
+    path('files/<path:name>', signed_file_view, name='signed-file'),
+    path('tasks/<str:task_id>/events/', task_status_events, name='task-events'),
 ]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
+# Статика админки при DEBUG: gunicorn, в отличие от runserver, сам её не раздаёт
+urlpatterns += staticfiles_urlpatterns()
+
 urlpatterns += [
     path('', include(router.urls)),
 ]
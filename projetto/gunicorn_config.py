@@ -1,2 +1,4 @@
 bind = "0.0.0.0:8000"
 workers = 4
+# ASGI: асинхронные view (SSE / long-poll событий задач) не занимают воркер на время ожидания
+worker_class = "uvicorn.workers.UvicornWorker"
@@ -7,7 +7,7 @@ from django.utils.html import format_html
 from django.contrib.admin.widgets import ForeignKeyRawIdWidget, FilteredSelectMultiple
 from django import forms
 
-from .models import Attachment, Cluster, Floor, Layout, Residence, Apartment, City
+from .models import Attachment, Cluster, Floor, FloorNumber, Layout, Residence, Apartment, City
 from .serializers import ResidenceSerializer, ClusterSerializer
 from .views import ResidenceViewSet
 # from service.models import User
@@ -102,6 +102,13 @@ class ClusterAdmin(admin.ModelAdmin):
     inlines = [FloorInline]
     actions = ['duplicate_floors']
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Инлайн сохраняет промежуточную модель напрямую, m2m_changed при этом не отправляется
+        FloorNumber.objects.filter(cluster=form.instance).delete()
+        for floor in form.instance.floors.all():
+            floor.sync_floor_numbers()
+
 
 class FloorAdmin(admin.ModelAdmin):
     
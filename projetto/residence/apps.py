@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ResidenceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'residence'
+
+    def ready(self):
+        from . import signals
+        from .search import create_search_indexes
+        post_migrate.connect(create_search_indexes, sender=self)
@@ -0,0 +1,118 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from app.compression import precompress, precompressed_response
+
+VERSION_KEY = 'catalog:version:{}'
+RESPONSE_KEY = 'catalog:response:v2:{}'
+
+
+class LocalLRUCache:
+    """LRU в памяти процесса с ограничением по количеству записей и времени жизни"""
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_cache = LocalLRUCache(settings.CATALOG_CACHE_LOCAL_SIZE, settings.CATALOG_CACHE_TIMEOUT)
+
+
+def get_model_versions(models):
+    """Текущие версии моделей из общего кэша. Версия - число, увеличиваемое при каждом изменении"""
+    keys = [VERSION_KEY.format(model._meta.label_lower) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Начинаем с текущего времени, чтобы после вытеснения ключа не совпасть со старой версией
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_model_version(model):
+    """Инвалидирует все закэшированные ответы, зависящие от модели"""
+    key = VERSION_KEY.format(model._meta.label_lower)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+class CachedResponseMixin:
+    """
+    Двухуровневый кэш JSON-ответов list и retrieve: LRU в памяти процесса и общий Redis.
+    Ключ строится из схемы, хоста, пути с query, типа пользователя и версий моделей из cache_models,
+    поэтому при изменении модели старые записи просто перестают находиться.
+    Вместе с телом хранятся его gzip/brotli варианты.
+    """
+    cache_models = ()
+
+    def get_response_cache_key(self, request):
+        models = self.cache_models or (self.get_queryset().model,)
+        auth = 'auth' if request.user.is_authenticated else 'anon'
+        # Схема и хост входят в ключ: в ответах абсолютные ссылки на файлы
+        parts = [request.scheme, request.get_host(), request.get_full_path(), request.accepted_renderer.format, auth]
+        parts += [str(version) for version in get_model_versions(models)]
+        return RESPONSE_KEY.format(hashlib.md5('|'.join(parts).encode()).hexdigest())
+
+    def cached_response(self, request, render):
+        if request.accepted_renderer.format != 'json':
+            return render()
+
+        key = self.get_response_cache_key(request)
+        entry = local_cache.get(key)
+        if entry is None:
+            entry = cache.get(key)
+            if entry is not None:
+                local_cache.set(key, entry)
+        if entry is not None:
+            content_type, variants = entry
+            return precompressed_response(request, variants, content_type)
+
+        response = render()
+        if response.status_code == 200:
+            response.add_post_render_callback(lambda rendered: self.store_response(key, rendered))
+        return response
+
+    def store_response(self, key, response):
+        # Сжатые варианты считаются один раз и хранятся рядом с исходным телом
+        entry = (response['Content-Type'], precompress(response.content, response['Content-Type']))
+        local_cache.set(key, entry)
+        cache.set(key, entry, settings.CATALOG_CACHE_TIMEOUT)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs))
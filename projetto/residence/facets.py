@@ -0,0 +1,118 @@
+from django.db.models import Count, Min, Prefetch, Q
+
+from .models import Apartment, Cluster, Layout
+
+ROOM_FACETS = (1, 2, 3, 4)
+PRICE_BUCKETS = (
+    (None, 100000),
+    (100000, 200000),
+    (200000, 300000),
+    (300000, None),
+)
+ORDERINGS = {
+    'price': 'min_price',
+    '-price': '-min_price',
+    'area': 'area',
+    '-area': '-area',
+}
+
+
+def price_range(price_min=None, price_max=None, prefix='layouts__', max_inclusive=True):
+    # price_max из запроса включается в диапазон; границы корзин фасета - полуинтервалы [min, max)
+    condition = Q()
+    if price_min is not None:
+        condition &= Q(**{f'{prefix}price_value__gte': price_min})
+    if price_max is not None:
+        lookup = 'lte' if max_inclusive else 'lt'
+        condition &= Q(**{f'{prefix}price_value__{lookup}': price_max})
+    return condition
+
+
+class ApartmentFacetSearch:
+    """
+    Фасетный поиск квартир. params - провалидированные ApartmentSearchParamsSerializer.
+
+    ЖК, город и площадь сужают выборку для всех фасетов. Комнаты, цена и пятно - фасеты:
+    счётчик каждого фасета учитывает остальные фасетные фильтры, но не свой, поэтому все
+    счётчики считаются условными Count(filter=...) в одном агрегирующем запросе.
+    """
+
+    def __init__(self, params):
+        self.params = params
+
+    def base_queryset(self):
+        params = self.params
+        queryset = Apartment.objects.all()
+        if params.get('residence_id'):
+            queryset = queryset.filter(floor__clusters__residence_id=params['residence_id'])
+        if params.get('city_id'):
+            queryset = queryset.filter(floor__clusters__residence_id__city_id=params['city_id'])
+        if params.get('area_min') is not None:
+            queryset = queryset.filter(area__gte=params['area_min'])
+        if params.get('area_max') is not None:
+            queryset = queryset.filter(area__lte=params['area_max'])
+        return queryset
+
+    def facet_filters(self):
+        params = self.params
+        filters = {}
+        if params.get('rooms'):
+            filters['rooms'] = Q(room_number__in=params['rooms'])
+        if params.get('price_min') is not None or params.get('price_max') is not None:
+            filters['price'] = price_range(params.get('price_min'), params.get('price_max'))
+        if params.get('clusters'):
+            filters['clusters'] = Q(floor__clusters__in=params['clusters'])
+        return filters
+
+    def condition(self, exclude=None):
+        condition = Q()
+        for name, facet_filter in self.facet_filters().items():
+            if name != exclude:
+                condition &= facet_filter
+        return condition
+
+    def results(self):
+        condition = self.condition()
+        # Во вложенных планировках показываем только подходящие по цене
+        layouts = Layout.objects.filter(price_range(self.params.get('price_min'), self.params.get('price_max'), prefix=''))
+
+        queryset = self.base_queryset().filter(condition).annotate(min_price=Min('layouts__price_value'))
+        ordering = ORDERINGS.get(self.params.get('ordering'), 'id')
+        return queryset.order_by(ordering, 'id').prefetch_related(Prefetch('layouts', queryset=layouts))
+
+    def facets(self):
+        aggregates = {'total': Count('id', distinct=True, filter=self.condition())}
+
+        rooms = self.condition(exclude='rooms')
+        for room_number in ROOM_FACETS:
+            aggregates[f'rooms_{room_number}'] = Count('id', distinct=True, filter=rooms & Q(room_number=room_number))
+        aggregates['rooms_more'] = Count('id', distinct=True, filter=rooms & Q(room_number__gt=ROOM_FACETS[-1]))
+
+        prices = self.condition(exclude='price')
+        for index, (price_min, price_max) in enumerate(PRICE_BUCKETS):
+            aggregates[f'price_{index}'] = Count('id', distinct=True, filter=prices & price_range(price_min, price_max, max_inclusive=False))
+
+        # Пятна как фасет имеют смысл только внутри одного ЖК
+        clusters = []
+        if self.params.get('residence_id'):
+            clusters = list(Cluster.objects.filter(residence_id=self.params['residence_id']).values_list('id', 'name'))
+        cluster_condition = self.condition(exclude='clusters')
+        for cluster_id, _ in clusters:
+            aggregates[f'cluster_{cluster_id}'] = Count('id', distinct=True, filter=cluster_condition & Q(floor__clusters=cluster_id))
+
+        counts = self.base_queryset().aggregate(**aggregates)
+
+        room_counts = {str(room_number): counts[f'rooms_{room_number}'] for room_number in ROOM_FACETS}
+        room_counts[f'{ROOM_FACETS[-1] + 1}+'] = counts['rooms_more']
+        return {
+            'total': counts['total'],
+            'rooms': room_counts,
+            'price': [
+                {'min': price_min, 'max': price_max, 'count': counts[f'price_{index}']}
+                for index, (price_min, price_max) in enumerate(PRICE_BUCKETS)
+            ],
+            'clusters': [
+                {'id': cluster_id, 'name': name, 'count': counts[f'cluster_{cluster_id}']}
+                for cluster_id, name in clusters
+            ],
+        }
@@ -0,0 +1,141 @@
+import hashlib
+import io
+import posixpath
+
+from PIL import Image, ImageOps
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+# Ширины (px) и форматы уменьшенных копий изображений каталога
+VARIANT_WIDTHS = (320, 640, 1280)
+VARIANT_FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 80, 'optimize': True, 'progressive': True},
+}
+
+
+def render_pdf_page(file, width=None, dpi=150):
+    """
+    Растеризует первую страницу PDF: по ширине width (px) или с разрешением dpi.
+    Нужен PyMuPDF; если он не установлен, возвращает None.
+    """
+    try:
+        import fitz
+    except ImportError:
+        return None
+
+    # PDF читается с произвольным доступом, поэтому файл целиком загружается в память воркера Celery
+    with file.open('rb'):
+        document = fitz.open(stream=file.read(), filetype='pdf')
+    try:
+        if not document.page_count:
+            return None
+        page = document.load_page(0)
+        zoom = width / page.rect.width if width else dpi / 72
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        return Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+    finally:
+        document.close()
+
+
+def is_pdf(name):
+    return posixpath.splitext(name)[1].lower() == '.pdf'
+
+
+def pending_image_fields(instance):
+    """Поля изображений, для которых варианты не построены или построены по старому файлу"""
+    pending = []
+    for field_name in instance.image_fields:
+        file = getattr(instance, field_name)
+        entry = instance.image_variants.get(field_name) or {}
+        if (file.name or None) != entry.get('source'):
+            pending.append(field_name)
+    return pending
+
+
+def variant_name(instance, field_name, source, width, extension):
+    # Хэш исходного имени в пути, чтобы новая загрузка не попадала в старый кэш браузера/CDN
+    digest = hashlib.md5(source.encode()).hexdigest()[:8]
+    return posixpath.join('variants', instance._meta.label_lower.replace('.', '_'), str(instance.pk),
+                          field_name, f'{width}-{digest}.{extension}')
+
+
+def delete_variants(storage, entry):
+    for extension in VARIANT_FORMATS:
+        for name in (entry.get(extension) or {}).values():
+            storage.delete(name)
+
+
+def build_variants(instance, field_name):
+    """Строит WebP/JPEG копии изображения по VARIANT_WIDTHS и возвращает запись для image_variants"""
+    file = getattr(instance, field_name)
+    # Копии всегда в default_storage: исходное поле может храниться по хэшу содержимого
+    delete_variants(default_storage, instance.image_variants.get(field_name) or {})
+
+    if not file.name:
+        return None
+
+    if is_pdf(file.name):
+        # Для PDF превью строится по первой странице
+        image = render_pdf_page(file, width=VARIANT_WIDTHS[-1])
+        if image is None:
+            return {'source': file.name}
+    else:
+        with file.open('rb'):
+            image = ImageOps.exif_transpose(Image.open(file))
+            image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.mode or 'transparency' in image.info else 'RGB')
+
+    # Не увеличиваем: ширины больше исходной заменяются одной копией в исходном размере
+    widths = [width for width in VARIANT_WIDTHS if width < image.width]
+    if image.width <= VARIANT_WIDTHS[-1]:
+        widths.append(image.width)
+
+    entry = {'source': file.name}
+    for extension, options in VARIANT_FORMATS.items():
+        entry[extension] = {}
+        for width in widths:
+            resized = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            if options['format'] == 'JPEG' and resized.mode != 'RGB':
+                resized = resized.convert('RGB')
+            buffer = io.BytesIO()
+            resized.save(buffer, **options)
+
+            name = variant_name(instance, field_name, file.name, width, extension)
+            entry[extension][str(width)] = default_storage.save(name, ContentFile(buffer.getvalue()))
+    return entry
+
+
+def image_srcset(instance, request=None):
+    """
+    srcset для каждого поля изображения: {'preview': {'webp': 'url 320w, url 640w', 'jpeg': ...}}.
+    Пока варианты не готовы, в обоих форматах отдаётся оригинал; для PDF оригинала нет - None.
+    """
+    def build_url(storage, name):
+        url = storage.url(name)
+        return request.build_absolute_uri(url) if request is not None else url
+
+    srcset = {}
+    for field_name in instance.image_fields:
+        file = getattr(instance, field_name)
+        if not file.name:
+            srcset[field_name] = None
+            continue
+
+        entry = instance.image_variants.get(field_name) or {}
+        if is_pdf(file.name) and not all(entry.get(extension) for extension in VARIANT_FORMATS):
+            srcset[field_name] = None
+            continue
+        # Копии не построены, построены по старому файлу или исходник не удалось разобрать
+        if entry.get('source') != file.name or not all(entry.get(extension) for extension in VARIANT_FORMATS):
+            original = build_url(file.storage, file.name)
+            srcset[field_name] = {extension: original for extension in VARIANT_FORMATS}
+            continue
+
+        srcset[field_name] = {
+            extension: ', '.join(f'{build_url(default_storage, name)} {width}w' for width, name in entry[extension].items())
+            for extension in VARIANT_FORMATS
+        }
+    return srcset
@@ -0,0 +1,75 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from residence.cache import bump_model_version
+from residence.models import Apartment, Floor
+from residence.snapshots import affected_residence_ids
+from residence.tasks import rebuild_residence_tree
+
+LEGACY_TABLE = 'residence_floor_apartments'
+
+
+class Command(BaseCommand):
+    help = ('Заполняет Apartment.floor у квартир без этажа: из старой таблицы связей этаж-квартиры '
+            '(--table) или из CSV с колонками apartment_id,floor_id (--csv). Уже заданные этажи не меняются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', default=LEGACY_TABLE, help='Таблица связей с колонками floor_id, apartment_id')
+        parser.add_argument('--csv', dest='csv_path', help='CSV с колонками apartment_id,floor_id')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, сколько квартир будет обновлено')
+
+    def read_table(self, table):
+        if table not in connection.introspection.table_names():
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT apartment_id, floor_id FROM {connection.ops.quote_name(table)}')
+            return cursor.fetchall()
+
+    def read_csv(self, path):
+        try:
+            with open(path, newline='') as file:
+                return [(int(row['apartment_id']), int(row['floor_id'])) for row in csv.DictReader(file)]
+        except (OSError, KeyError, ValueError) as e:
+            raise CommandError(f'Не удалось прочитать {path}: {e}')
+
+    def handle(self, *args, **options):
+        if options['csv_path']:
+            pairs = self.read_csv(options['csv_path'])
+        else:
+            pairs = self.read_table(options['table'])
+            if pairs is None:
+                missing = Apartment.objects.filter(floor__isnull=True).count()
+                self.stdout.write(self.style.WARNING(
+                    f"Таблица {options['table']} не найдена, квартир без этажа: {missing}. "
+                    f"Передайте соответствие через --csv."))
+                return
+
+        # Квартира, привязанная к нескольким этажам, получает первый из них
+        floor_by_apartment = {}
+        for apartment_id, floor_id in sorted(pairs):
+            floor_by_apartment.setdefault(apartment_id, floor_id)
+
+        floor_ids = set(Floor.objects.filter(id__in=set(floor_by_apartment.values())).values_list('id', flat=True))
+        pending = Apartment.objects.filter(id__in=floor_by_apartment, floor__isnull=True).values_list('id', flat=True)
+        updates = {pk: floor_by_apartment[pk] for pk in pending if floor_by_apartment[pk] in floor_ids}
+
+        if options['dry_run']:
+            self.stdout.write(f'Будет обновлено квартир: {len(updates)}')
+            return
+
+        now = timezone.now()
+        with transaction.atomic():
+            for apartment_id, floor_id in updates.items():
+                # update() не вызывает сигналы, поэтому кэш и снимки деревьев обновляются ниже
+                Apartment.objects.filter(id=apartment_id, floor__isnull=True).update(floor_id=floor_id, updated_at=now)
+
+        if updates:
+            bump_model_version(Apartment)
+            for residence_id in affected_residence_ids(Apartment, updates):
+                rebuild_residence_tree.delay(residence_id)
+
+        missing = Apartment.objects.filter(floor__isnull=True).count()
+        self.stdout.write(self.style.SUCCESS(f'Обновлено квартир: {len(updates)}, без этажа осталось: {missing}'))
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from residence.models import StoredBlob
+from residence.storage import blob_storage
+
+
+class Command(BaseCommand):
+    help = 'Удаляет файлы по хэшу, на которые не ссылается ни один объект (загружены, но не сохранены в модели)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-hours', type=int, default=24)
+
+    def handle(self, *args, **options):
+        threshold = timezone.now() - timedelta(hours=options['older_than_hours'])
+        candidates = StoredBlob.objects.filter(refcount=0, updated_at__lt=threshold)
+        deleted = 0
+        for pk in list(candidates.values_list('pk', flat=True)):
+            with transaction.atomic():
+                # Под блокировкой строки проверяем заново: пока шёл обход, на файл могли сослаться
+                # или загрузить его повторно (_save держит ту же блокировку)
+                blob = candidates.select_for_update().filter(pk=pk).first()
+                if blob is None:
+                    continue
+                blob_storage(blob.name).delete(blob.name)
+                blob.delete()
+            deleted += 1
+        self.stdout.write(self.style.SUCCESS(f'Удалено файлов: {deleted}'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from residence.images import pending_image_fields
+from residence.models import Residence, Attachment, Layout
+from residence.tasks import generate_image_variants
+
+
+class Command(BaseCommand):
+    help = 'Ставит в очередь построение уменьшенных копий для изображений без актуальных вариантов'
+
+    def handle(self, *args, **options):
+        queued = 0
+        for model in (Residence, Attachment, Layout):
+            for instance in model.objects.iterator():
+                if pending_image_fields(instance):
+                    generate_image_variants.delay(model._meta.label, instance.pk)
+                    queued += 1
+        self.stdout.write(self.style.SUCCESS(f'Поставлено в очередь: {queued}'))
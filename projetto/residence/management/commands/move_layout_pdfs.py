@@ -0,0 +1,34 @@
+import posixpath
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from residence.models import Layout
+from residence.storage import PROTECTED_BLOB_PREFIX, blob_storage
+
+
+class Command(BaseCommand):
+    help = ('Переносит PDF планировок из MEDIA_ROOT (blobs/ и старые PDF/) в защищённое хранилище '
+            '(paid/ в PROTECTED_MEDIA_ROOT). Публичная копия удаляется')
+
+    def handle(self, *args, **options):
+        layouts = Layout.objects.exclude(pdf='').exclude(pdf__startswith=PROTECTED_BLOB_PREFIX)
+        moved, missing = 0, 0
+        for name in sorted(set(layouts.values_list('pdf', flat=True))):
+            # И blobs/, и старые PDF/ лежат в MEDIA_ROOT
+            if not default_storage.exists(name):
+                missing += 1
+                self.stdout.write(self.style.WARNING(f'{name}: файл не найден'))
+                continue
+            with default_storage.open(name, 'rb') as file:
+                for layout in layouts.filter(pdf=name):
+                    # Файл по хэшу и ссылка на него сохраняются одной транзакцией (BlobReferencesMixin),
+                    # старый blob из blobs/ отпускают сигналы после коммита
+                    with transaction.atomic():
+                        layout.pdf.save(posixpath.basename(name), file, save=True)
+                    moved += 1
+            if blob_storage(name) is None:
+                # Старые PDF/ не учитываются в StoredBlob - публичную копию удаляем сами
+                default_storage.delete(name)
+        self.stdout.write(self.style.SUCCESS(f'Перенесено планировок: {moved}, файлов не найдено: {missing}'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from residence.cache import bump_model_version
+from residence.models import Layout
+
+
+class Command(BaseCommand):
+    help = 'Заполняет числовую цену Layout.price_value из строкового поля price'
+
+    def handle(self, *args, **options):
+        layouts = list(Layout.objects.only('id', 'price', 'price_value'))
+        changed = []
+        for layout in layouts:
+            price_value = Layout.parse_price(layout.price)
+            if layout.price_value != price_value:
+                layout.price_value = price_value
+                changed.append(layout)
+
+        Layout.objects.bulk_update(changed, ['price_value'], batch_size=500)
+        bump_model_version(Layout)
+        self.stdout.write(self.style.SUCCESS(f'Обновлено планировок: {len(changed)} из {len(layouts)}'))
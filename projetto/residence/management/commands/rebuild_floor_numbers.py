@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from residence.models import Floor
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает индекс (пятно, номер этажа) -> этаж из Floor.floor_numbers'
+
+    def handle(self, *args, **options):
+        count = 0
+        for floor in Floor.objects.iterator():
+            floor.sync_floor_numbers()
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Обработано этажей: {count}'))
@@ -0,0 +1,14 @@
+from django.db import models
+
+
+class ResidenceQuerySet(models.QuerySet):
+
+    def with_tree(self):
+        """
+        Prefetch the whole Residence -> Cluster -> Floor -> Apartment -> Layout
+        hierarchy. The number of queries does not depend on the residence size.
+        """
+        return self.prefetch_related(
+            'attachment_set',
+            'clusters__floors__apartments__layouts',
+        )
@@ -0,0 +1,143 @@
+import hashlib
+import posixpath
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+
+from drf_yasg.utils import swagger_auto_schema
+
+from .serializers import BulkIdsParamsSerializer
+from .tiles import tile_name
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified для list и retrieve. Валидаторы считаются одним
+    агрегирующим запросом (max(updated_at) + count) по отфильтрованному queryset,
+    поэтому 304 отдаётся до сериализации.
+
+    conditional_related - связи, изменение которых тоже меняет ответ (например 'attachment').
+    """
+    conditional_related = ()
+
+    def get_conditional_validators(self, queryset):
+        aggregates = {'count': Count('pk', distinct=True), 'updated_at': Max('updated_at')}
+        for lookup in self.conditional_related:
+            aggregates[f'{lookup}_count'] = Count(f'{lookup}__pk', distinct=True)
+            aggregates[f'{lookup}_updated_at'] = Max(f'{lookup}__updated_at')
+        stats = queryset.aggregate(**aggregates)
+
+        timestamps = [value for key, value in stats.items() if key.endswith('updated_at') and value is not None]
+        last_modified = int(max(timestamps).timestamp()) if timestamps else None
+
+        key = '|'.join([self.request.get_full_path(), self.request.accepted_renderer.format] +
+                       [f'{name}={stats[name]}' for name in sorted(stats)])
+        etag = 'W/"%s"' % hashlib.md5(key.encode()).hexdigest()
+        return etag, last_modified
+
+    def conditional_response(self, request, queryset, render):
+        etag, last_modified = self.get_conditional_validators(queryset)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        response = render()
+        if response.status_code == 200:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.conditional_response(request, queryset, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+        except (ValueError, TypeError, ValidationError):
+            # /clusters/abc/ - как и get_object(), отвечаем 404, а не 500
+            raise NotFound()
+        return self.conditional_response(request, queryset, lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs))
+
+
+class BulkRetrieveMixin:
+    """
+    GET .../bulk/?ids=1,2,3 - несколько объектов одним IN-запросом, ответ в виде {id: объект}.
+
+    bulk_prefetch - связи, которые подгружаются заранее;
+    bulk_serializer_class - сериализатор ответа, по умолчанию обычный сериализатор view.
+    """
+    bulk_max_ids = 100
+    bulk_prefetch = ()
+    bulk_serializer_class = None
+
+    @swagger_auto_schema(query_serializer=BulkIdsParamsSerializer)
+    @action(detail=False, methods=['get'])
+    def bulk(self, request):
+        """Возвращает объекты по списку ID"""
+        params = BulkIdsParamsSerializer(data=request.query_params, context={'max_ids': self.bulk_max_ids})
+        params.is_valid(raise_exception=True)
+
+        queryset = self.get_queryset().filter(pk__in=params.validated_data['ids']).prefetch_related(*self.bulk_prefetch)
+        serializer_class = self.bulk_serializer_class or self.get_serializer_class()
+        serializer = serializer_class(queryset, many=True, context=self.get_serializer_context())
+        return Response({str(item['id']): item for item in serializer.data})
+
+
+class TilesMixin:
+    """
+    Deep Zoom для большого плана из поля tiled_field:
+    GET .../{id}/tiles/ - описание пирамиды и шаблон URL тайлов,
+    GET .../{id}/tiles/{level}/{col}_{row}/?v=<version> - тайл. С актуальной версией кэшируется на год.
+    """
+    tiled_field = None
+    tile_cache_seconds = 60 * 60 * 24 * 365
+
+    def get_tile_pyramid(self):
+        instance = self.get_object()
+        entry = instance.tile_pyramids.get(self.tiled_field) or {}
+        if not entry.get('path') or entry.get('source') != getattr(instance, self.tiled_field).name:
+            raise NotFound('Tiles are not ready.')
+        return instance, entry
+
+    @action(detail=True, methods=['get'])
+    def tiles(self, request, pk=None):
+        """Описание пирамиды тайлов плана (Deep Zoom)"""
+        _, entry = self.get_tile_pyramid()
+        version = posixpath.basename(entry['path'])
+        return Response({
+            'width': entry['width'],
+            'height': entry['height'],
+            'tile_size': entry['tile_size'],
+            'overlap': entry['overlap'],
+            'format': entry['format'],
+            'max_level': entry['max_level'],
+            'version': version,
+            'url': request.build_absolute_uri(request.path) + '{level}/{col}_{row}/?v=' + version,
+        })
+
+    @action(detail=True, methods=['get'], url_path=r'tiles/(?P<level>\d+)/(?P<col>\d+)_(?P<row>\d+)')
+    def tile(self, request, pk=None, level=None, col=None, row=None):
+        """Один тайл плана"""
+        instance, entry = self.get_tile_pyramid()
+        storage = getattr(instance, self.tiled_field).storage
+        name = tile_name(entry, int(level), int(col), int(row))
+        if not storage.exists(name):
+            raise NotFound('Tile not found.')
+
+        response = FileResponse(storage.open(name, 'rb'), content_type=f"image/{entry['format']}")
+        # Путь тайла зависит от версии плана, поэтому с ?v= ответ неизменяем
+        if request.query_params.get('v') == posixpath.basename(entry['path']):
+            patch_cache_control(response, public=True, max_age=self.tile_cache_seconds, immutable=True)
+        else:
+            patch_cache_control(response, no_cache=True)
+        return response
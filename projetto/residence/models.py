@@ -1,6 +1,11 @@
+import re
+
 from django.db import models
 from django.utils import timezone
 
+from .managers import ResidenceQuerySet
+from .storage import content_addressed_storage, protected_content_storage, BlobReferencesMixin
+
 
 class Timestamp(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
@@ -30,6 +35,14 @@ class Residence(Timestamp):
     website_url = models.URLField("Сайт", max_length=150, blank=True, null=True)
     gen_plan = models.ImageField("Генеральный план", upload_to='residence/gen_plans/', blank=True, null=True)
     poster = models.ImageField("Постер", upload_to='residence/posters/', blank=True, null=True)
+    image_variants = models.JSONField("Уменьшенные копии изображений", default=dict, blank=True, editable=False)
+    tile_pyramids = models.JSONField("Тайлы планов", default=dict, blank=True, editable=False)
+
+    image_fields = ('gen_plan', 'poster')
+    tiled_fields = ('gen_plan',)
+
+    objects = ResidenceQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Жилой комплекс'
         verbose_name_plural = 'Жилые комплексы'
@@ -42,6 +55,9 @@ class Attachment(Timestamp):
     residence_id = models.ForeignKey("Residence", on_delete=models.CASCADE, blank=True)
     name = models.CharField(max_length=100, blank=True)
     image = models.ImageField("Attachment", upload_to='residence/images/', blank=True)
+    image_variants = models.JSONField("Уменьшенные копии изображений", default=dict, blank=True, editable=False)
+
+    image_fields = ('image',)
 
     class Meta:
         verbose_name = 'Вложение'
@@ -67,6 +83,10 @@ class Floor(Timestamp):
     floor_numbers = models.CharField("Номера Этажей",max_length=50, blank=True, help_text="Пример: 1,2,3")
     clusters = models.ManyToManyField("Cluster", related_name='floors', blank=True)
     scheme = models.FileField("Схема", upload_to='floor/schemes/', blank=True)
+    tile_pyramids = models.JSONField("Тайлы планов", default=dict, blank=True, editable=False)
+
+    tiled_fields = ('scheme',)
+
     class Meta:
         verbose_name = 'Этаж'
         verbose_name_plural = 'Этажи'
@@ -74,25 +94,70 @@ class Floor(Timestamp):
     def __str__(self):
         return f"Этажи {self.floor_numbers}"
 
+    @staticmethod
+    def parse_floor_numbers(floor_numbers, max_range=200):
+        """'1,2,5-7' -> {1, 2, 5, 6, 7}. Нераспознанные части пропускаются"""
+        numbers = set()
+        for part in (floor_numbers or '').split(','):
+            part = part.strip()
+            match = re.fullmatch(r'(-?\d+)\s*[-–]\s*(-?\d+)', part)
+            if match:
+                start, end = int(match.group(1)), int(match.group(2))
+                if 0 <= end - start <= max_range:
+                    numbers.update(range(start, end + 1))
+            elif re.fullmatch(r'-?\d+', part):
+                numbers.add(int(part))
+        return numbers
+
+    def sync_floor_numbers(self):
+        """Перестраивает индекс (пятно, номер этажа) -> этаж из floor_numbers и связей с пятнами"""
+        FloorNumber.objects.filter(floor=self).delete()
+        numbers = self.parse_floor_numbers(self.floor_numbers)
+        FloorNumber.objects.bulk_create([
+            FloorNumber(floor=self, cluster_id=cluster_id, number=number)
+            for cluster_id in self.clusters.values_list('id', flat=True)
+            for number in numbers
+        ])
+
+
+class FloorNumber(models.Model):
+    floor = models.ForeignKey("Floor", related_name='numbers', on_delete=models.CASCADE)
+    cluster = models.ForeignKey("Cluster", related_name='floor_numbers', on_delete=models.CASCADE)
+    number = models.IntegerField("Номер этажа")
+
+    class Meta:
+        verbose_name = 'Номер этажа'
+        verbose_name_plural = 'Номера этажей'
+        indexes = [
+            models.Index(fields=['cluster', 'number']),
+        ]
+
+    def __str__(self):
+        return f"Этаж {self.number} пятна #{self.cluster_id}"
+
 
 class Apartment(Timestamp):
     name = models.CharField("Название", max_length=50, blank=True)
     door_number = models.CharField("Номер квартиры",max_length=50, blank=True, help_text="132")
     room_number = models.IntegerField("Количество комнат", blank=True)
-    area = models.FloatField("Плошадь(m²)", blank=True)
+    area = models.FloatField("Плошадь(m²)", blank=True, db_index=True)
+    floor = models.ForeignKey("Floor", verbose_name="Этаж", related_name='apartments', on_delete=models.SET_NULL, blank=True, null=True)
     layouts = models.ManyToManyField("Layout", verbose_name="Варианты планировки", related_name='apartments', blank=True)
     class Meta:
         verbose_name = 'Квартира'
         verbose_name_plural = 'Квартиры'
         
         ordering = ['id']
+        indexes = [
+            models.Index(fields=['room_number', 'area']),
+        ]
     
     def __str__(self):
         return f"{self.id}. Квартира №{self.door_number}"
 
 
 
-class Layout(Timestamp):
+class Layout(BlobReferencesMixin, Timestamp):
     TYPE_CHOICES = (
         ('def', 'Основная'),
         ('ver', 'Вертикальная'),
@@ -101,24 +166,85 @@ class Layout(Timestamp):
     name = models.CharField("Название", max_length=50, blank=True)
     variant = models.IntegerField("Вариант", blank=True, help_text="Номер варианта которое отоборжается в планировке")
     type_of_apartment = models.CharField("Тип квартиры", choices=TYPE_CHOICES, max_length=100, blank=True)
-    pdf = models.FileField("PDF", upload_to="PDF/", blank=True)
-    preview = models.ImageField("Превью", upload_to="preview/", blank=True)
-    before_view = models.ImageField("Вид до", upload_to="before_view/", blank=True)
-    after_view = models.ImageField("Вид после", upload_to="after_view/", blank=True)
+    pdf = models.FileField("PDF", upload_to="PDF/", storage=protected_content_storage, blank=True)
+    preview = models.ImageField("Превью", upload_to="preview/", storage=content_addressed_storage, blank=True)
+    before_view = models.ImageField("Вид до", upload_to="before_view/", storage=content_addressed_storage, blank=True)
+    after_view = models.ImageField("Вид после", upload_to="after_view/", storage=content_addressed_storage, blank=True)
     price = models.CharField(max_length=10, blank=True)
+    price_value = models.PositiveBigIntegerField("Цена (число)", blank=True, null=True, db_index=True, editable=False)
     room_number = models.IntegerField("Количество комнат", blank=True)
+    image_variants = models.JSONField("Уменьшенные копии изображений", default=dict, blank=True, editable=False)
+
+    # pdf - превью первой страницы
+    image_fields = ('preview', 'before_view', 'after_view', 'pdf')
 
     class Meta:
         verbose_name = 'Планировка'
         verbose_name_plural = 'Планировки'
         ordering = ['id']
+        indexes = [
+            models.Index(fields=['room_number', 'price_value']),
+        ]
 
     def __str__(self):
         return f"№{self.id}. Планировка {self.name} {self.room_number}.{self.variant}/{self.type_of_apartment}"
 
+    @staticmethod
+    def parse_price(price):
+        """Числовая цена из строки: '150 000' -> 150000, '99.90' -> 99, '' -> None"""
+        price = re.sub(r'[.,]\d{1,2}$', '', (price or '').strip())
+        digits = re.sub(r'\D', '', price)
+        return int(digits) if digits else None
+
+    def save(self, *args, **kwargs):
+        self.price_value = self.parse_price(self.price)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'price' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'price_value'}
+        super().save(*args, **kwargs)
+
     def get_appartment(self, apartment_id):
         appartment = self.apartments.filter(id=apartment_id).first()
         return appartment
 
 
+class ResidenceTreeSnapshot(models.Model):
+    # 1 - исходный формат get_residence_tree (список пятен), 2 - ЖК с вложениями и планировками
+    VERSION_CHOICES = (
+        (1, 'Список пятен'),
+        (2, 'ЖК целиком'),
+    )
+
+    residence = models.ForeignKey("Residence", related_name='tree_snapshots', on_delete=models.CASCADE)
+    version = models.PositiveSmallIntegerField("Формат", choices=VERSION_CHOICES, default=1)
+    data = models.BinaryField("JSON дерева")
+    # Сжатые варианты data, чтобы не сжимать дерево на каждый запрос
+    data_gzip = models.BinaryField("JSON дерева (gzip)", null=True, blank=True)
+    data_br = models.BinaryField("JSON дерева (brotli)", null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Снимок дерева ЖК'
+        verbose_name_plural = 'Снимки дерева ЖК'
+        constraints = [
+            models.UniqueConstraint(fields=['residence', 'version'], name='unique_residence_tree_version'),
+        ]
+
+    def __str__(self):
+        return f"Дерево ЖК #{self.residence_id} (v{self.version})"
 
+
+class StoredBlob(models.Model):
+    name = models.CharField("Путь", max_length=255, unique=True)
+    size = models.PositiveBigIntegerField("Размер")
+    refcount = models.PositiveIntegerField("Количество ссылок", default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Обновляется при каждом сохранении тех же байт: collect_blobs не трогает недавно загруженные файлы
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Файл (по хэшу)'
+        verbose_name_plural = 'Файлы (по хэшу)'
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
@@ -0,0 +1,87 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db import connection, connections
+from django.db.models import Case, IntegerField, Q, Value, When
+from rest_framework import filters
+
+from .models import Apartment, City, Layout, Residence
+
+# Колонки, по которым ищут RankedSearchFilter; для них создаются триграммные индексы
+SEARCH_INDEXES = (
+    (Residence, 'title'),
+    (City, 'name'),
+    (Layout, 'name'),
+    (Apartment, 'name'),
+    (Apartment, 'door_number'),
+)
+
+
+def prefix_query(query):
+    """tsquery, где каждое слово ищется как префикс: 'жк алм' -> 'жк:* & алм:*'"""
+    words = [re.sub(r'\W', '', word) for word in query.split()]
+    return SearchQuery(' & '.join(f'{word}:*' for word in words if word), config='simple', search_type='raw')
+
+
+class RankedSearchFilter(filters.SearchFilter):
+    """
+    Поиск по ?search= с сортировкой по релевантности.
+
+    На PostgreSQL отбор идёт по условиям, которые обслуживают триграммные GIN-индексы
+    (icontains и word similarity), а ранг - полнотекстовый с префиксами плюс триграммная
+    близость к первому полю из search_fields. На остальных БД (SQLite в тестах) -
+    icontains, совпадения с начала первого поля выше.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+        if not search_fields or not search_terms:
+            return queryset
+
+        query = ' '.join(search_terms)
+        if connection.vendor == 'postgresql':
+            return self.postgres_search(queryset, search_fields, query)
+        return self.fallback_search(queryset, search_fields, query)
+
+    def postgres_search(self, queryset, search_fields, query):
+        condition = Q()
+        for field in search_fields:
+            condition |= Q(**{f'{field}__icontains': query}) | Q(**{f'{field}__trigram_word_similar': query})
+
+        vector = SearchVector(search_fields[0], weight='A', config='simple')
+        for field in search_fields[1:]:
+            vector += SearchVector(field, weight='B', config='simple')
+        rank = SearchRank(vector, prefix_query(query)) + TrigramWordSimilarity(query, search_fields[0])
+
+        return queryset.filter(condition).annotate(search_rank=rank).order_by('-search_rank', 'pk')
+
+    def fallback_search(self, queryset, search_fields, query):
+        condition = Q()
+        for field in search_fields:
+            condition |= Q(**{f'{field}__icontains': query})
+
+        rank = Case(
+            When(**{f'{search_fields[0]}__istartswith': query}, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        return queryset.filter(condition).annotate(search_rank=rank).order_by('-search_rank', 'pk')
+
+
+def create_search_indexes(sender, using, **kwargs):
+    """
+    post_migrate: расширение pg_trgm и GIN-индексы для RankedSearchFilter.
+    Индекс по UPPER(col) нужен для icontains, по самой колонке - для word similarity.
+    """
+    db = connections[using]
+    if db.vendor != 'postgresql':
+        return
+
+    with db.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for model, field_name in SEARCH_INDEXES:
+            table = model._meta.db_table
+            column = model._meta.get_field(field_name).column
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {table}_{column}_trgm ON {table} USING gin ({column} gin_trgm_ops)')
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {table}_{column}_upper_trgm ON {table} USING gin ((UPPER({column})) gin_trgm_ops)')
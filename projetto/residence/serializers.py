@@ -1,20 +1,36 @@
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from .models import Residence, Apartment, Attachment, Cluster, Floor, Layout, City
+from .images import image_srcset
 from datetime import timezone
-class ResidenceSerializer(serializers.ModelSerializer):
-    city_name = serializers.StringRelatedField(source='city.name')
-    attachments = serializers.SerializerMethodField()
-    class Meta:
-        model = Residence
-        fields = '__all__'
-        read_only_fields = ('created_at', 'updated_at')
-    
-    def perform_update(self, serializer):
-        serializer.save(updated_at=timezone.now())
 
-    def get_attachments(self, obj):
-        attachments = Attachment.objects.filter(residence_id=obj.id)
-        return AttachmentSerializer(attachments, many=True).data
+
+def get_requested_fields(request):
+    """Возвращает множество полей из ?fields=a,b,c или None, если параметр не передан"""
+    fields = request.query_params.get('fields') if request else None
+    if not fields:
+        return None
+    return {field.strip() for field in fields.split(',') if field.strip()}
+
+class SparseFieldsMixin:
+    """Оставляет в ответе только поля, перечисленные в ?fields="""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = get_requested_fields(self.context.get('request'))
+        if requested is not None:
+            for field_name in set(self.fields) - requested:
+                self.fields.pop(field_name)
+
+class ImageVariantsMixin:
+    """Заменяет служебное image_variants на srcset; пока копии не готовы, отдаётся оригинал"""
+    def get_fields(self):
+        fields = super().get_fields()
+        fields.pop('image_variants', None)
+        fields['srcset'] = serializers.SerializerMethodField()
+        return fields
+
+    def get_srcset(self, obj):
+        return image_srcset(obj, self.context.get('request'))
 
 class ApartmentSerializer(serializers.ModelSerializer):
     class Meta:
@@ -25,7 +41,7 @@ class ApartmentSerializer(serializers.ModelSerializer):
     def perform_update(self, serializer):
         serializer.save(updated_at=timezone.now())
 
-class AttachmentSerializer(serializers.ModelSerializer):
+class AttachmentSerializer(ImageVariantsMixin, serializers.ModelSerializer):
     image = serializers.ImageField(max_length=None, allow_empty_file=False, use_url=True)
     class Meta:
         model = Attachment
@@ -35,6 +51,18 @@ class AttachmentSerializer(serializers.ModelSerializer):
     def perform_update(self, serializer):
         serializer.save(updated_at=timezone.now())
 
+class ResidenceSerializer(SparseFieldsMixin, ImageVariantsMixin, serializers.ModelSerializer):
+    # Ожидает queryset с select_related('city') и prefetch_related('attachment_set')
+    city_name = serializers.CharField(source='city.name', read_only=True)
+    attachments = AttachmentSerializer(source='attachment_set', many=True, read_only=True)
+    class Meta:
+        model = Residence
+        exclude = ('tile_pyramids', )
+        read_only_fields = ('created_at', 'updated_at')
+    
+    def perform_update(self, serializer):
+        serializer.save(updated_at=timezone.now())
+
 class ClusterSerializer(serializers.ModelSerializer):
     class Meta:
         model = Cluster
@@ -47,13 +75,13 @@ class ClusterSerializer(serializers.ModelSerializer):
 class FloorSerializer(serializers.ModelSerializer):
     class Meta:
         model = Floor
-        fields = '__all__'
+        exclude = ('tile_pyramids', )
         read_only_fields = ('created_at', 'updated_at')
     
     def perform_update(self, serializer):
         serializer.save(updated_at=timezone.now())
 
-class LayoutSerializer(serializers.ModelSerializer):
+class LayoutSerializer(ImageVariantsMixin, serializers.ModelSerializer):
     # pdf = serializers.FileField(max_length=None, allow_empty_file=False, use_url=True)
     class Meta:
         model = Layout
@@ -63,13 +91,19 @@ class LayoutSerializer(serializers.ModelSerializer):
     def perform_update(self, serializer):
         serializer.save(updated_at=timezone.now())
 
-class LayoutRetrieveSerializer(serializers.ModelSerializer):
-    pdf = serializers.FileField(max_length=None, allow_empty_file=False, use_url=True)
+class LayoutRetrieveSerializer(ImageVariantsMixin, serializers.ModelSerializer):
+    # Не публичная ссылка на media, а защищённая точка скачивания
+    pdf = serializers.SerializerMethodField()
     class Meta:
         model = Layout
         fields = '__all__'
         read_only_fields = ('created_at', 'updated_at')
     
+    def get_pdf(self, obj):
+        if not obj.pdf:
+            return None
+        return reverse('layout-pdf', args=[obj.pk], request=self.context.get('request'))
+
     def perform_update(self, serializer):
         serializer.save(updated_at=timezone.now())
 
@@ -81,3 +115,98 @@ class CitySerializer(serializers.ModelSerializer):
     
     def perform_update(self, serializer):
         serializer.save(updated_at=timezone.now())
+
+class LayoutTreeSerializer(ImageVariantsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Layout
+        fields = ('id', 'name', 'variant', 'type_of_apartment', 'room_number', 'price', 'preview')
+
+class ApartmentTreeSerializer(serializers.ModelSerializer):
+    layouts = LayoutTreeSerializer(many=True, read_only=True)
+    class Meta:
+        model = Apartment
+        fields = ('id', 'name', 'door_number', 'room_number', 'area', 'layouts')
+
+class FloorTreeSerializer(serializers.ModelSerializer):
+    apartments = ApartmentTreeSerializer(many=True, read_only=True)
+    class Meta:
+        model = Floor
+        fields = ('id', 'floor_numbers', 'scheme', 'apartments')
+
+class ClusterTreeSerializer(serializers.ModelSerializer):
+    floors = FloorTreeSerializer(many=True, read_only=True)
+    class Meta:
+        model = Cluster
+        fields = ('id', 'name', 'max_floor', 'date_to_start_sell', 'floors')
+
+class ResidenceTreeSerializer(serializers.ModelSerializer):
+    """Дерево ЖК: пятна -> этажи -> квартиры -> планировки. Ожидает queryset с with_tree()"""
+    attachments = AttachmentSerializer(source='attachment_set', many=True, read_only=True)
+    clusters = ClusterTreeSerializer(many=True, read_only=True)
+    class Meta:
+        model = Residence
+        fields = ('id', 'title', 'slug', 'attachments', 'clusters')
+
+class ApartmentTreeV1Serializer(serializers.ModelSerializer):
+    class Meta:
+        model = Apartment
+        fields = ('id', 'room_number', 'area')
+
+class FloorTreeV1Serializer(serializers.ModelSerializer):
+    apartments = ApartmentTreeV1Serializer(many=True, read_only=True)
+    class Meta:
+        model = Floor
+        fields = ('id', 'floor_numbers', 'apartments')
+
+class ClusterTreeV1Serializer(serializers.ModelSerializer):
+    """Исходный формат get_residence_tree (список пятен), на него рассчитан мобильный клиент"""
+    floors = FloorTreeV1Serializer(many=True, read_only=True)
+    class Meta:
+        model = Cluster
+        fields = ('id', 'name', 'floors')
+
+class ApartmentSearchSerializer(serializers.ModelSerializer):
+    layouts = LayoutSerializer(many=True, read_only=True)
+    min_price = serializers.IntegerField(read_only=True)
+    class Meta:
+        model = Apartment
+        fields = ('id', 'name', 'door_number', 'room_number', 'area', 'floor', 'min_price', 'layouts')
+
+class ApartmentBulkSerializer(ApartmentSerializer):
+    layouts = LayoutSerializer(many=True, read_only=True)
+
+class ApartmentSearchParamsSerializer(serializers.Serializer):
+    rooms = serializers.CharField(required=False, help_text="Количество комнат через запятую: 1,2")
+    area_min = serializers.FloatField(required=False)
+    area_max = serializers.FloatField(required=False)
+    price_min = serializers.IntegerField(required=False, min_value=0)
+    price_max = serializers.IntegerField(required=False, min_value=0)
+    residence_id = serializers.IntegerField(required=False)
+    city_id = serializers.IntegerField(required=False)
+    clusters = serializers.CharField(required=False, help_text="ID пятен через запятую")
+    ordering = serializers.ChoiceField(required=False, choices=['price', '-price', 'area', '-area'])
+
+    @staticmethod
+    def parse_id_list(value):
+        try:
+            return [int(item) for item in value.split(',') if item.strip()]
+        except ValueError:
+            raise serializers.ValidationError("Ожидается список чисел через запятую")
+
+    def validate_rooms(self, value):
+        return self.parse_id_list(value)
+
+    def validate_clusters(self, value):
+        return self.parse_id_list(value)
+
+class BulkIdsParamsSerializer(serializers.Serializer):
+    ids = serializers.CharField(help_text="ID через запятую: 1,2,3")
+
+    def validate_ids(self, value):
+        ids = list(dict.fromkeys(ApartmentSearchParamsSerializer.parse_id_list(value)))
+        if not ids:
+            raise serializers.ValidationError("Передайте хотя бы один ID")
+        max_ids = self.context.get('max_ids')
+        if max_ids and len(ids) > max_ids:
+            raise serializers.ValidationError(f"Не больше {max_ids} ID за запрос")
+        return ids
@@ -0,0 +1,151 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import bump_model_version
+from .images import pending_image_fields
+from .tiles import pending_tile_fields
+from .models import City, Residence, Attachment, Cluster, Floor, FloorNumber, Apartment, Layout
+from .snapshots import TREE_LOOKUPS, affected_residence_ids
+from .storage import blob_fields, acquire_blob, release_blob
+from .tasks import rebuild_residence_tree, generate_image_variants, generate_tile_pyramid
+
+
+def schedule_tree_rebuild(residence_ids):
+    """Пересобирает снимки деревьев ЖК в фоне после коммита транзакции"""
+    for residence_id in residence_ids:
+        transaction.on_commit(lambda residence_id=residence_id: rebuild_residence_tree.delay(residence_id), robust=True)
+
+
+CATALOG_MODELS = (City, Residence, Attachment, Cluster, Floor, Apartment, Layout)
+
+
+def schedule_version_bump(*models):
+    """Сбрасывает кэш ответов каталога после коммита, чтобы не закэшировать старые данные"""
+    for model in set(models):
+        transaction.on_commit(lambda model=model: bump_model_version(model), robust=True)
+
+
+@receiver(pre_save)
+def remember_tree_residences(sender, instance, **kwargs):
+    if sender not in TREE_LOOKUPS or instance.pk is None:
+        return
+    # Состояние до сохранения: объект мог переехать в другой ЖК
+    instance._tree_residence_ids = affected_residence_ids(sender, [instance.pk])
+
+
+@receiver(post_save)
+def rebuild_tree_on_save(sender, instance, raw=False, **kwargs):
+    if sender not in TREE_LOOKUPS or raw:
+        return
+    residence_ids = affected_residence_ids(sender, [instance.pk])
+    residence_ids |= getattr(instance, '_tree_residence_ids', set())
+    schedule_tree_rebuild(residence_ids)
+
+
+@receiver(pre_delete)
+def rebuild_tree_on_delete(sender, instance, **kwargs):
+    if sender not in TREE_LOOKUPS:
+        return
+    schedule_tree_rebuild(affected_residence_ids(sender, [instance.pk]))
+
+
+@receiver(m2m_changed, sender=Floor.clusters.through)
+@receiver(m2m_changed, sender=Apartment.layouts.through)
+def rebuild_tree_on_m2m_change(sender, instance, action, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    residence_ids = affected_residence_ids(type(instance), [instance.pk])
+    if pk_set:
+        residence_ids |= affected_residence_ids(model, pk_set)
+    schedule_tree_rebuild(residence_ids)
+
+
+@receiver(m2m_changed, sender=Floor.clusters.through)
+@receiver(m2m_changed, sender=Apartment.layouts.through)
+def touch_on_m2m_change(sender, instance, action, model, pk_set, **kwargs):
+    # Изменение M2M не обновляет updated_at, а на нём построены ETag/Last-Modified каталога
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    now = timezone.now()
+    type(instance).objects.filter(pk=instance.pk).update(updated_at=now)
+    if pk_set:
+        model.objects.filter(pk__in=pk_set).update(updated_at=now)
+    schedule_version_bump(type(instance), model)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def bump_version_on_change(sender, instance, **kwargs):
+    if sender in CATALOG_MODELS:
+        schedule_version_bump(sender)
+
+
+@receiver(post_save, sender=Floor)
+def sync_floor_numbers_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance.sync_floor_numbers()
+
+
+@receiver(m2m_changed, sender=Floor.clusters.through)
+def sync_floor_numbers_on_m2m_change(sender, instance, action, pk_set, reverse, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        instance.sync_floor_numbers()
+    elif action == 'post_clear':
+        FloorNumber.objects.filter(cluster=instance).delete()
+    else:
+        for floor in Floor.objects.filter(pk__in=pk_set):
+            floor.sync_floor_numbers()
+
+
+IMAGE_MODELS = (Residence, Attachment, Layout)
+
+
+@receiver(post_save)
+def generate_image_variants_on_save(sender, instance, raw=False, **kwargs):
+    if sender not in IMAGE_MODELS or raw or not pending_image_fields(instance):
+        return
+    transaction.on_commit(
+        lambda label=sender._meta.label, pk=instance.pk: generate_image_variants.delay(label, pk), robust=True)
+
+
+TILED_MODELS = (Residence, Floor)
+
+
+@receiver(post_save)
+def generate_tile_pyramid_on_save(sender, instance, raw=False, **kwargs):
+    if sender not in TILED_MODELS or raw or not pending_tile_fields(instance):
+        return
+    transaction.on_commit(
+        lambda label=sender._meta.label, pk=instance.pk: generate_tile_pyramid.delay(label, pk), robust=True)
+
+
+@receiver(pre_save)
+def remember_blob_names(sender, instance, **kwargs):
+    fields = blob_fields(sender)
+    if not fields:
+        return
+    old = sender._base_manager.filter(pk=instance.pk).values(*fields).first() if instance.pk else None
+    instance._old_blob_names = old or {}
+
+
+@receiver(post_save)
+def count_blob_references(sender, instance, **kwargs):
+    for field_name in blob_fields(sender):
+        old_name = instance._old_blob_names.get(field_name) or ''
+        new_name = getattr(instance, field_name).name or ''
+        if old_name == new_name:
+            continue
+        acquire_blob(new_name)
+        # Старый файл отпускаем только после коммита: при откате объект продолжит на него ссылаться
+        transaction.on_commit(lambda name=old_name: release_blob(name), robust=True)
+    instance._old_blob_names = {field_name: getattr(instance, field_name).name for field_name in blob_fields(sender)}
+
+
+@receiver(post_delete)
+def release_blobs_on_delete(sender, instance, **kwargs):
+    for field_name in blob_fields(sender):
+        transaction.on_commit(lambda name=getattr(instance, field_name).name: release_blob(name), robust=True)
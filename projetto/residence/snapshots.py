@@ -0,0 +1,72 @@
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.http import QueryDict
+from rest_framework.renderers import JSONRenderer
+
+from app.compression import precompress
+
+from .models import Residence, Cluster, Floor, Apartment, Layout, Attachment, ResidenceTreeSnapshot
+from .serializers import ResidenceTreeSerializer, ClusterTreeV1Serializer
+
+# Путь от Residence до модели, изменение которой меняет дерево ЖК
+TREE_LOOKUPS = {
+    Residence: 'pk',
+    Attachment: 'attachment',
+    Cluster: 'clusters',
+    Floor: 'clusters__floors',
+    Apartment: 'clusters__floors__apartments',
+    Layout: 'clusters__floors__apartments__layouts',
+}
+
+
+def affected_residence_ids(model, pks):
+    """Возвращает id ЖК, в дерево которых входят объекты model с переданными pk"""
+    pks = [pk for pk in pks if pk is not None]
+    if not pks:
+        return set()
+    lookup = TREE_LOOKUPS[model] + '__in'
+    return set(Residence.objects.filter(**{lookup: pks}).values_list('id', flat=True))
+
+
+class SiteRequest:
+    """Вместо request при сериализации в фоне: сериализаторы строят абсолютные ссылки от SITE_URL"""
+    query_params = QueryDict()
+
+    def build_absolute_uri(self, location=None):
+        return urljoin(settings.SITE_URL, location or '/')
+
+
+# Форматы дерева: 1 - список пятен (как было), 2 - ЖК с вложениями и планировками
+TREE_VERSIONS = {
+    1: lambda residence, context: ClusterTreeV1Serializer(residence.clusters.all(), many=True, context=context).data,
+    2: lambda residence, context: ResidenceTreeSerializer(residence, context=context).data,
+}
+TREE_DEFAULT_VERSION = 1
+
+
+def build_tree_snapshots(residence_id):
+    """Сериализует дерево ЖК во всех форматах и сохраняет готовый JSON; возвращает {версия: снимок}"""
+    residence = Residence.objects.with_tree().filter(pk=residence_id).first()
+    if residence is None:
+        return {}
+
+    context = {'request': SiteRequest()}
+    snapshots = {}
+    for version, serialize in TREE_VERSIONS.items():
+        data = JSONRenderer().render(serialize(residence, context))
+        variants = precompress(data, 'application/json')
+        defaults = {
+            'data': data,
+            'data_gzip': variants.get('gzip'),
+            'data_br': variants.get('br'),
+        }
+        try:
+            snapshots[version], _ = ResidenceTreeSnapshot.objects.update_or_create(
+                residence=residence, version=version, defaults=defaults)
+        except IntegrityError:
+            # Первый снимок одновременно собрали запрос и задача: строка уже вставлена другим,
+            # её данные собраны из того же состояния каталога
+            snapshots[version] = ResidenceTreeSnapshot.objects.get(residence=residence, version=version)
+    return snapshots
@@ -0,0 +1,113 @@
+import hashlib
+import posixpath
+from functools import lru_cache
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F, FileField
+from django.utils.deconstruct import deconstructible
+
+from app.sendfile import ProtectedStorageMixin
+
+BLOB_PREFIX = 'blobs/'
+PROTECTED_BLOB_PREFIX = 'paid/'
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище с адресацией по содержимому: файл сохраняется один раз под своим SHA-256
+    (blobs/ab/cd/<sha256>.<ext>), повторная загрузка тех же байт возвращает существующее имя.
+    Имя не меняется, пока не меняется содержимое, поэтому URL можно кэшировать навсегда.
+    Сколько объектов ссылается на файл, считает StoredBlob (acquire_blob / release_blob).
+    """
+    prefix = BLOB_PREFIX
+
+    def get_available_name(self, name, max_length=None):
+        # Одинаковое содержимое - одно имя, суффиксы не нужны
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+
+        extension = posixpath.splitext(name)[1].lower()
+        hexdigest = digest.hexdigest()
+        name = f'{self.prefix}{hexdigest[:2]}/{hexdigest[2:4]}/{hexdigest}{extension}'
+
+        from .models import StoredBlob
+        with transaction.atomic():
+            # Блокировка строки защищает от одновременного удаления последней ссылки; она держится
+            # до конца внешней транзакции (BlobReferencesMixin.save), в которой берётся ссылка
+            blob, created = StoredBlob.objects.select_for_update().get_or_create(name=name, defaults={'size': content.size})
+            if not created:
+                blob.save(update_fields=['updated_at'])
+            if not self.exists(name):
+                super()._save(name, content)
+        return name
+
+
+@deconstructible
+class ProtectedContentAddressedStorage(ProtectedStorageMixin, ContentAddressedStorage):
+    """Платные файлы по хэшу (PDF планировок): отдельный префикс в PROTECTED_MEDIA_ROOT, отдаются только через sendfile"""
+    prefix = PROTECTED_BLOB_PREFIX
+
+
+content_addressed_storage = ContentAddressedStorage()
+protected_content_storage = ProtectedContentAddressedStorage()
+
+
+def blob_storage(name):
+    """Хранилище, в котором лежит blob с таким именем, или None, если имя не из хранилищ по хэшу"""
+    for storage in (content_addressed_storage, protected_content_storage):
+        if name and name.startswith(storage.prefix):
+            return storage
+    return None
+
+
+class BlobReferencesMixin:
+    """
+    Для моделей с полями в ContentAddressedStorage: сохранение файла (_save), строки модели и ссылка
+    на blob (сигнал post_save) идут в одной транзакции, collect_blobs не увидит blob без ссылки.
+    FieldFile.save(..., save=True) сохраняет файл до save() модели - такие вызовы оборачиваются в transaction.atomic().
+    """
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+@lru_cache(maxsize=None)
+def blob_fields(model):
+    """Имена файловых полей модели, хранящихся в ContentAddressedStorage"""
+    return tuple(field.name for field in model._meta.get_fields()
+                 if isinstance(field, FileField) and isinstance(field.storage, ContentAddressedStorage))
+
+
+def acquire_blob(name):
+    """Добавляет ссылку на blob (вызывается, когда объект начинает ссылаться на файл)"""
+    from .models import StoredBlob
+    if blob_storage(name) is not None:
+        StoredBlob.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+
+def release_blob(name):
+    """Убирает ссылку на blob; файл удаляется, когда ссылок не осталось"""
+    from .models import StoredBlob
+    storage = blob_storage(name)
+    if storage is None:
+        return
+    with transaction.atomic():
+        blob = StoredBlob.objects.select_for_update().filter(name=name).first()
+        if blob is None:
+            return
+        if blob.refcount > 1:
+            blob.refcount = F('refcount') - 1
+            blob.save(update_fields=['refcount'])
+            return
+        blob.delete()
+        storage.delete(name)
@@ -0,0 +1,70 @@
+import logging
+
+from django.apps import apps
+
+from app.celery import app as celery_app
+
+from .images import pending_image_fields, build_variants
+from .tiles import pending_tile_fields, build_pyramid
+from .snapshots import build_tree_snapshots
+
+logger = logging.getLogger(__name__)
+
+
+@celery_app.task
+def rebuild_residence_tree(residence_id):
+    snapshots = build_tree_snapshots(residence_id)
+    return [snapshot.pk for snapshot in snapshots.values()]
+
+
+@celery_app.task
+def generate_image_variants(model_label, pk):
+    """Строит уменьшенные копии изображений объекта, у которых сменился исходный файл"""
+    instance = apps.get_model(model_label).objects.filter(pk=pk).first()
+    if instance is None:
+        return []
+
+    pending = pending_image_fields(instance)
+    if not pending:
+        return []
+
+    for field_name in pending:
+        try:
+            entry = build_variants(instance, field_name)
+        except Exception:
+            # Битый файл (fitz.FileDataError, PIL.UnidentifiedImageError, ...) не мешает остальным полям.
+            # Источник запоминается, чтобы сохранение объекта не ставило задачу снова; отдаётся оригинал
+            logger.exception('Image variants failed for %s #%s %s', model_label, pk, field_name)
+            entry = {'source': getattr(instance, field_name).name}
+        if entry is None:
+            instance.image_variants.pop(field_name, None)
+        else:
+            instance.image_variants[field_name] = entry
+    # Обычный save: сработают сигналы пересборки дерева и сброса кэша
+    instance.save(update_fields=['image_variants', 'updated_at'])
+    return pending
+
+
+@celery_app.task
+def generate_tile_pyramid(model_label, pk):
+    """Режет на тайлы планы объекта, у которых сменился исходный файл"""
+    instance = apps.get_model(model_label).objects.filter(pk=pk).first()
+    if instance is None:
+        return []
+
+    pending = pending_tile_fields(instance)
+    if not pending:
+        return []
+
+    for field_name in pending:
+        try:
+            entry = build_pyramid(instance, field_name)
+        except Exception:
+            logger.exception('Tile pyramid failed for %s #%s %s', model_label, pk, field_name)
+            entry = {'source': getattr(instance, field_name).name, 'path': None}
+        if entry is None:
+            instance.tile_pyramids.pop(field_name, None)
+        else:
+            instance.tile_pyramids[field_name] = entry
+    instance.save(update_fields=['tile_pyramids', 'updated_at'])
+    return pending
@@ -1,3 +1,586 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import brotli
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from app.compression import CompressionMiddleware
+from app.signing import file_signature
+from app.testing import TemporaryMediaMixin, create_layout, create_tree, image_file, pdf_file
+from service.models import User
+
+from .cache import local_cache
+from .facets import ApartmentFacetSearch
+from .models import City, Residence, Attachment, Cluster, Floor, FloorNumber, Apartment, Layout, ResidenceTreeSnapshot, \
+    StoredBlob
+from .snapshots import build_tree_snapshots
+from .storage import content_addressed_storage, protected_content_storage
+from .tasks import generate_image_variants, generate_tile_pyramid
+
+PDF_CONTENT = b'%PDF-1.4 layout'
+
+
+class ResidenceTreeTests(TemporaryMediaMixin, TestCase):
+    def tree_queries(self, residence):
+        ResidenceTreeSnapshot.objects.all().delete()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/residences/{residence.pk}/get_residence_tree/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_tree_size(self):
+        small = create_tree()
+        large = create_tree(clusters=3, floors=3, apartments=3)
+        self.assertEqual(self.tree_queries(small), self.tree_queries(large))
+
+    def test_default_response_keeps_legacy_shape(self):
+        residence = create_tree()
+        data = self.client.get(f'/residences/{residence.pk}/get_residence_tree/').json()
+        self.assertIsInstance(data, list)
+        self.assertEqual(set(data[0]), {'id', 'name', 'floors'})
+        self.assertEqual(set(data[0]['floors'][0]['apartments'][0]), {'id', 'room_number', 'area'})
+
+        data = self.client.get(f'/residences/{residence.pk}/get_residence_tree/?version=2').json()
+        self.assertEqual(data['id'], residence.pk)
+
+    def test_snapshot_is_served_with_one_query(self):
+        residence = create_tree()
+        self.client.get(f'/residences/{residence.pk}/get_residence_tree/')
+        with self.assertNumQueries(1):
+            self.client.get(f'/residences/{residence.pk}/get_residence_tree/')
+
+    @override_settings(SITE_URL='https://projetto.example')
+    def test_snapshot_urls_are_absolute(self):
+        residence = create_tree()
+        Layout.objects.update(preview='preview/layout.png')
+        snapshot = build_tree_snapshots(residence.pk)[2]
+        self.assertIn(b'"https://projetto.example/media/preview/layout.png"', bytes(snapshot.data))
+
+    def test_concurrent_first_build_reuses_stored_snapshot(self):
+        residence = create_tree()
+        stored = build_tree_snapshots(residence.pk)
+        with mock.patch.object(ResidenceTreeSnapshot.objects, 'update_or_create', side_effect=IntegrityError):
+            snapshots = build_tree_snapshots(residence.pk)
+        self.assertEqual({version: snapshot.pk for version, snapshot in snapshots.items()},
+                         {version: snapshot.pk for version, snapshot in stored.items()})
+
+    def test_backfill_apartment_floors_from_csv(self):
+        floor = Floor.objects.create(floor_numbers='1')
+        placed = Apartment.objects.create(room_number=1, area=40, floor=floor)
+        orphan = Apartment.objects.create(room_number=1, area=40)
+        other_floor = Floor.objects.create(floor_numbers='2')
+
+        path = os.path.join(self.media_root, 'floors.csv')
+        with open(path, 'w') as file:
+            file.write(f'apartment_id,floor_id\n{orphan.pk},{floor.pk}\n{placed.pk},{other_floor.pk}\n')
+        call_command('backfill_apartment_floors', csv=path, stdout=mock.Mock())
+
+        orphan.refresh_from_db()
+        placed.refresh_from_db()
+        self.assertEqual(orphan.floor, floor)
+        # Уже заданный этаж не перезаписывается
+        self.assertEqual(placed.floor, floor)
+
+
+class ResidenceListTests(TemporaryMediaMixin, TestCase):
+    def create_residences(self, count):
+        for index in range(count):
+            residence = create_tree(clusters=0, title=f'ЖК {index}')
+            for name in ('Фасад', 'Двор'):
+                Attachment.objects.create(residence_id=residence, name=name)
+
+    def list_queries(self, path='/residences/'):
+        local_cache.clear()
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()['results']
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.create_residences(1)
+        one, _ = self.list_queries()
+        self.create_residences(4)
+        many, results = self.list_queries()
+        self.assertEqual(len(results), 5)
+        self.assertEqual(one, many)
+        self.assertEqual(len(results[0]['attachments']), 2)
+        self.assertEqual(results[0]['city_name'], 'Алматы')
+
+    def test_fields_trims_response_and_skips_attachments(self):
+        self.create_residences(2)
+        full, _ = self.list_queries()
+        trimmed, results = self.list_queries('/residences/?fields=id,title')
+        self.assertEqual(set(results[0]), {'id', 'title'})
+        self.assertEqual(trimmed, full - 1)
+
+        residence = Residence.objects.first()
+        data = self.client.get(f'/residences/{residence.pk}/?fields=title,attachments').json()
+        self.assertEqual(set(data), {'title', 'attachments'})
+
+
+class ConditionalGetTests(TemporaryMediaMixin, TestCase):
+    def test_matching_etag_returns_304(self):
+        cluster = create_tree().clusters.get()
+        response = self.client.get(f'/clusters/{cluster.pk}/')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(f'/clusters/{cluster.pk}/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_object_returns_200(self):
+        cluster = create_tree().clusters.get()
+        etag = self.client.get(f'/clusters/{cluster.pk}/')['ETag']
+        Cluster.objects.filter(pk=cluster.pk).update(name='Новый', updated_at=timezone.now() + timedelta(seconds=1))
+        self.assertEqual(self.client.get(f'/clusters/{cluster.pk}/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_malformed_lookup_returns_404(self):
+        self.assertEqual(self.client.get('/clusters/abc/').status_code, 404)
+
+
+class ResponseCacheTests(TemporaryMediaMixin, TestCase):
+    def test_repeated_request_is_served_from_cache(self):
+        city = City.objects.create(name='Астана')
+        self.assertEqual(self.client.get(f'/cities/{city.pk}/').json()['name'], 'Астана')
+        # update() не вызывает сигналы, поэтому закэшированный ответ остаётся прежним
+        City.objects.filter(pk=city.pk).update(name='Нур-Султан')
+        # Остаётся только запрос ConditionalGetMixin за Last-Modified
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/cities/{city.pk}/')
+        self.assertEqual(response.json()['name'], 'Астана')
+
+    def test_model_save_invalidates_cached_responses(self):
+        city = City.objects.create(name='Астана')
+        self.client.get(f'/cities/{city.pk}/')
+        city.name = 'Нур-Султан'
+        with self.captureOnCommitCallbacks(execute=True):
+            city.save()
+        self.assertEqual(self.client.get(f'/cities/{city.pk}/').json()['name'], 'Нур-Султан')
+
+    def test_scheme_and_host_are_part_of_the_key(self):
+        residence = create_tree(clusters=0)
+        Residence.objects.filter(pk=residence.pk).update(poster='residence/posters/poster.png')
+        path = f'/residences/{residence.pk}/?fields=poster'
+        self.assertTrue(self.client.get(path).json()['poster'].startswith('http://testserver/'))
+        self.assertTrue(self.client.get(path, secure=True).json()['poster'].startswith('https://testserver/'))
+        self.assertTrue(self.client.get(path, HTTP_HOST='localhost').json()['poster'].startswith('http://localhost/'))
+
+
+class RankedSearchTests(TemporaryMediaMixin, TestCase):
+    def test_matches_at_title_start_come_first(self):
+        for title in ('Park Alatau', 'Alatau City', 'Nurly Tau', 'Alatau'):
+            create_tree(clusters=0, title=title)
+        results = self.client.get('/residences/?search=alatau').json()['results']
+        self.assertEqual([residence['title'] for residence in results], ['Alatau City', 'Alatau', 'Park Alatau'])
+
+        suggestions = self.client.get('/residences/autocomplete/?search=alatau').json()
+        self.assertEqual([residence['title'] for residence in suggestions], ['Alatau City', 'Alatau', 'Park Alatau'])
+
+
+class FacetSearchTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.apartments = {}
+        for price in (99999, 100000, 150000):
+            apartment = Apartment.objects.create(room_number=1, area=40)
+            apartment.layouts.add(create_layout(room_number=1, price=str(price)))
+            self.apartments[price] = apartment
+
+    def test_price_max_is_inclusive(self):
+        results = ApartmentFacetSearch({'price_max': 100000}).results()
+        self.assertEqual(set(results), {self.apartments[99999], self.apartments[100000]})
+
+    def test_price_buckets_do_not_overlap(self):
+        buckets = ApartmentFacetSearch({}).facets()['price']
+        self.assertEqual([bucket['count'] for bucket in buckets], [1, 2, 0, 0])
+
+    def test_price_above_integer_range(self):
+        apartment = Apartment.objects.create(room_number=4, area=200)
+        apartment.layouts.add(create_layout(room_number=4, price='9999999999'))
+        self.assertEqual(Layout.objects.get(price='9999999999').price_value, 9999999999)
+
+        data = self.client.get('/apartments/search/?price_min=3000000000').json()
+        self.assertEqual([item['id'] for item in data['results']], [apartment.pk])
+
+
+class FloorLookupTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cluster = create_tree(clusters=1, floors=0).clusters.get()
+        self.floor = Floor.objects.create(floor_numbers='2, 5-7')
+        self.floor.clusters.add(self.cluster)
+
+    def numbers(self):
+        return set(FloorNumber.objects.filter(floor=self.floor).values_list('cluster_id', 'number'))
+
+    def test_floor_numbers_follow_floor_and_clusters(self):
+        self.assertEqual(self.numbers(), {(self.cluster.pk, number) for number in (2, 5, 6, 7)})
+
+        self.floor.floor_numbers = '3'
+        self.floor.save()
+        self.assertEqual(self.numbers(), {(self.cluster.pk, 3)})
+
+        self.cluster.floors.clear()
+        self.assertEqual(self.numbers(), set())
+
+    def test_lookup_by_floor_number(self):
+        response = self.client.get(f'/floors/lookup/?cluster_id={self.cluster.pk}&floor_number=6')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], self.floor.pk)
+
+        self.assertEqual(self.client.get(f'/floors/lookup/?cluster_id={self.cluster.pk}&floor_number=4').status_code, 404)
+        self.assertEqual(self.client.get(f'/floors/lookup/?cluster_id={self.cluster.pk}&floor_number=x').status_code, 400)
+        self.assertEqual(self.client.get('/floors/lookup/?floor_number=6').status_code, 400)
+
+    def test_rebuild_floor_numbers(self):
+        FloorNumber.objects.all().delete()
+        # Список этажей, затем на каждый этаж: старые номера, пятна, вставка новых
+        with self.assertNumQueries(4):
+            call_command('rebuild_floor_numbers', stdout=mock.Mock())
+        self.assertEqual(len(self.numbers()), 4)
+
+
+class CursorPaginationTests(TemporaryMediaMixin, TestCase):
+    def test_next_and_previous_links(self):
+        residences = [create_tree(clusters=0, title=f'ЖК {index}') for index in range(15)]
+        first = self.client.get('/residences/?pagination=cursor').json()
+        self.assertNotIn('count', first)
+        self.assertIsNone(first['previous'])
+
+        second = self.client.get(first['next']).json()
+        self.assertIsNone(second['next'])
+        self.assertEqual([residence['id'] for residence in first['results'] + second['results']],
+                         [residence.pk for residence in reversed(residences)])
+
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+
+    def test_cursor_with_search_is_rejected(self):
+        create_tree(clusters=0, title='Alatau')
+        self.assertEqual(self.client.get('/residences/?search=alatau&pagination=cursor').status_code, 400)
+        self.assertEqual(self.client.get('/residences/?search=alatau&page=1').status_code, 200)
+
+    def test_apartments_are_paginated_on_request(self):
+        residence = create_tree(apartments=3)
+        cluster = residence.clusters.get()
+        path = f'/apartments/?residence_id={residence.pk}&cluster_id={cluster.pk}&floor_id={cluster.floors.get().pk}'
+        self.assertEqual(len(self.client.get(path).json()), 3)
+
+        data = self.client.get(f'{path}&pagination=cursor').json()
+        self.assertEqual(len(data['results']), 3)
+        self.assertIsNone(data['next'])
+
+
+class BulkRetrieveTests(TemporaryMediaMixin, TestCase):
+    def test_response_is_keyed_by_id(self):
+        layouts = [create_layout(name=name) for name in ('A', 'B', 'C')]
+        ids = f'{layouts[2].pk},{layouts[0].pk},{layouts[0].pk},999'
+        data = self.client.get(f'/layouts/bulk/?ids={ids}').json()
+        self.assertEqual(set(data), {str(layouts[0].pk), str(layouts[2].pk)})
+        self.assertEqual(data[str(layouts[2].pk)]['name'], 'C')
+
+    def test_invalid_ids_return_400(self):
+        for ids in ('', 'a,b', '1,,x'):
+            self.assertEqual(self.client.get(f'/layouts/bulk/?ids={ids}').status_code, 400)
+        self.assertEqual(self.client.get('/layouts/bulk/').status_code, 400)
+
+    def test_at_most_100_ids(self):
+        ids = ','.join(str(pk) for pk in range(1, 101))
+        self.assertEqual(self.client.get(f'/layouts/bulk/?ids={ids}').status_code, 200)
+        self.assertEqual(self.client.get(f'/layouts/bulk/?ids={ids},101').status_code, 400)
+
+
+class ImageVariantsTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        residence = create_tree(clusters=0)
+        self.attachment = Attachment.objects.create(residence_id=residence, name='Фасад', image=image_file(size=(800, 600)))
+
+    def srcset(self):
+        return self.client.get(f'/attachments/{self.attachment.pk}/').json()['srcset']['image']
+
+    def test_original_is_served_until_variants_are_ready(self):
+        srcset = self.srcset()
+        self.assertEqual(srcset['webp'], srcset['jpeg'])
+        self.assertTrue(srcset['webp'].endswith(self.attachment.image.name))
+
+    def test_variants_are_built_without_upscaling(self):
+        self.assertEqual(generate_image_variants('residence.attachment', self.attachment.pk), ['image'])
+        self.attachment.refresh_from_db()
+        entry = self.attachment.image_variants['image']
+        self.assertEqual(entry['source'], self.attachment.image.name)
+        self.assertEqual(set(entry['webp']), {'320', '640', '800'})
+        self.assertTrue(all(default_storage.exists(name) for name in entry['jpeg'].values()))
+
+        srcset = self.srcset()
+        self.assertIn(' 320w, ', srcset['webp'])
+        self.assertTrue(srcset['jpeg'].endswith('.jpeg 800w'))
+        # Повторный запуск по тому же файлу ничего не делает
+        self.assertEqual(generate_image_variants('residence.attachment', self.attachment.pk), [])
+
+    def test_new_upload_replaces_old_variants(self):
+        generate_image_variants('residence.attachment', self.attachment.pk)
+        self.attachment.refresh_from_db()
+        old = list(self.attachment.image_variants['image']['webp'].values())
+
+        self.attachment.image = image_file('new.png', size=(400, 300))
+        self.attachment.save()
+        generate_image_variants('residence.attachment', self.attachment.pk)
+        self.attachment.refresh_from_db()
+        self.assertEqual(set(self.attachment.image_variants['image']['webp']), {'320', '400'})
+        self.assertFalse(any(default_storage.exists(name) for name in old))
+
+
+class TilePyramidTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.residence = create_tree(clusters=0)
+        self.residence.gen_plan = image_file('plan.png', size=(600, 400))
+        self.residence.save()
+
+    def test_manifest_describes_pyramid(self):
+        self.assertEqual(self.client.get(f'/residences/{self.residence.pk}/tiles/').status_code, 404)
+
+        generate_tile_pyramid('residence.residence', self.residence.pk)
+        manifest = self.client.get(f'/residences/{self.residence.pk}/tiles/').json()
+        self.assertEqual((manifest['width'], manifest['height'], manifest['max_level']), (600, 400, 10))
+        self.assertEqual(manifest['tile_size'], 256)
+        self.assertEqual(manifest['url'], f'http://testserver/residences/{self.residence.pk}/tiles/'
+                                          '{level}/{col}_{row}/?v=' + manifest['version'])
+
+    def test_versioned_tile_is_immutable(self):
+        generate_tile_pyramid('residence.residence', self.residence.pk)
+        manifest = self.client.get(f'/residences/{self.residence.pk}/tiles/').json()
+        tile_url = manifest['url'].format(level=10, col=2, row=1)
+
+        response = self.client.get(tile_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], f"image/{manifest['format']}")
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+        response = self.client.get(tile_url.split('?')[0])
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertEqual(self.client.get(manifest['url'].format(level=10, col=9, row=9)).status_code, 404)
+
+
+class LayoutPdfTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.layout = create_layout(pdf=SimpleUploadedFile('layout.pdf', PDF_CONTENT))
+        self.user = User.objects.create_user(username='user', password='password')
+        self.client.force_login(self.user)
+
+    def test_pdf_is_not_public(self):
+        self.assertTrue(self.layout.pdf.name.startswith('paid/'))
+        self.assertTrue(protected_content_storage.exists(self.layout.pdf.name))
+        self.assertFalse(default_storage.exists(self.layout.pdf.name))
+
+    def test_pdf_requires_login(self):
+        response = self.client.get(f'/layouts/{self.layout.pk}/pdf/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), PDF_CONTENT)
+
+        self.client.logout()
+        self.assertIn(self.client.get(f'/layouts/{self.layout.pk}/pdf/', secure=True).status_code, (401, 403))
+
+    def test_missing_file_returns_404(self):
+        self.layout.pdf.storage.delete(self.layout.pdf.name)
+        self.assertEqual(self.client.get(f'/layouts/{self.layout.pk}/pdf/', secure=True).status_code, 404)
+
+    def test_range_request_returns_206(self):
+        response = self.client.get(f'/layouts/{self.layout.pk}/pdf/', HTTP_RANGE='bytes=0-3', secure=True)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 0-3/{len(PDF_CONTENT)}')
+        self.assertEqual(b''.join(response.streaming_content), PDF_CONTENT[:4])
+
+        response = self.client.get(f'/layouts/{self.layout.pk}/pdf/', HTTP_RANGE='bytes=-6', secure=True)
+        self.assertEqual(b''.join(response.streaming_content), PDF_CONTENT[-6:])
+
+    def test_unsatisfiable_range_returns_416(self):
+        response = self.client.get(f'/layouts/{self.layout.pk}/pdf/', HTTP_RANGE='bytes=1000-', secure=True)
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(PDF_CONTENT)}')
+
+    def test_stale_if_range_returns_whole_file(self):
+        response = self.client.get(f'/layouts/{self.layout.pk}/pdf/', secure=True)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        response = self.client.get(f'/layouts/{self.layout.pk}/pdf/', HTTP_RANGE='bytes=0-3',
+                                   HTTP_IF_RANGE='Thu, 01 Jan 1970 00:00:00 GMT', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), PDF_CONTENT)
+
+    def signed_path(self):
+        url = self.client.get(f'/layouts/{self.layout.pk}/pdf_url/', secure=True).json()['url']
+        return url.split('://', 1)[1].split('/', 1)[1]
+
+    def test_signed_url_serves_file_without_session(self):
+        path = self.signed_path()
+        self.client.logout()
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/{path}', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), PDF_CONTENT)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertNotIn('private', response['Cache-Control'])
+
+    def test_tampered_signed_url_returns_404(self):
+        path = self.signed_path()
+        self.assertEqual(self.client.get(f'/{path.replace("signature=", "signature=0")}', secure=True).status_code, 404)
+        self.assertEqual(self.client.get(f'/{path.replace("layout-", "other-")}', secure=True).status_code, 404)
+
+    def test_expired_signed_url_returns_404(self):
+        name, filename = self.layout.pdf.name, f'layout-{self.layout.pk}.pdf'
+        expires = int(time.time()) - 1
+        signature = file_signature(name, expires, filename)
+        response = self.client.get(f'/files/{name}?expires={expires}&filename={filename}&signature={signature}', secure=True)
+        self.assertEqual(response.status_code, 404)
+
+
+class BlobRefcountTests(TemporaryMediaMixin, TestCase):
+    def create_layout(self, content=PDF_CONTENT):
+        return create_layout(pdf=SimpleUploadedFile('layout.pdf', content))
+
+    def test_same_content_is_stored_once(self):
+        first, second = self.create_layout(), self.create_layout()
+        self.assertEqual(first.pdf.name, second.pdf.name)
+        self.assertEqual(StoredBlob.objects.get(name=first.pdf.name).refcount, 2)
+
+    def test_file_is_deleted_with_last_reference(self):
+        first, second = self.create_layout(), self.create_layout()
+        name = first.pdf.name
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(StoredBlob.objects.get(name=name).refcount, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(StoredBlob.objects.filter(name=name).exists())
+        self.assertFalse(protected_content_storage.exists(name))
+
+    def test_collect_blobs_keeps_referenced_and_recent_files(self):
+        layout = self.create_layout()
+        orphan = protected_content_storage.save('orphan.pdf', ContentFile(b'%PDF orphan'))
+        recent = protected_content_storage.save('recent.pdf', ContentFile(b'%PDF recent'))
+        StoredBlob.objects.exclude(name=recent).update(updated_at=timezone.now() - timedelta(days=2))
+
+        call_command('collect_blobs', stdout=mock.Mock())
+
+        self.assertEqual(set(StoredBlob.objects.values_list('name', flat=True)), {layout.pdf.name, recent})
+        self.assertFalse(protected_content_storage.exists(orphan))
+        self.assertTrue(protected_content_storage.exists(layout.pdf.name))
+
+    def test_move_layout_pdfs_moves_blobs_and_legacy_names(self):
+        legacy = default_storage.save('PDF/old.pdf', ContentFile(b'%PDF legacy'))
+        blob = content_addressed_storage.save('public.pdf', ContentFile(b'%PDF public'))
+        StoredBlob.objects.filter(name=blob).update(refcount=2)
+        layouts = [create_layout(), create_layout(), create_layout()]
+        Layout.objects.filter(pk=layouts[0].pk).update(pdf=legacy)
+        Layout.objects.filter(pk__in=[layouts[1].pk, layouts[2].pk]).update(pdf=blob)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('move_layout_pdfs', stdout=mock.Mock())
+
+        for layout in layouts:
+            layout.refresh_from_db()
+            self.assertTrue(layout.pdf.name.startswith('paid/'))
+        self.assertEqual(layouts[1].pdf.name, layouts[2].pdf.name)
+        self.assertEqual(StoredBlob.objects.get(name=layouts[1].pdf.name).refcount, 2)
+        self.assertFalse(default_storage.exists(legacy))
+        self.assertFalse(default_storage.exists(blob))
+        self.assertFalse(StoredBlob.objects.filter(name=blob).exists())
+
+        self.client.force_login(User.objects.create_user(username='user', password='password'))
+        response = self.client.get(f'/layouts/{layouts[0].pk}/pdf/', secure=True)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF legacy')
+
+
+class LayoutPreviewTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_user(username='user', password='password'))
+
+    def srcset(self, layout):
+        return self.client.get(f'/layouts/{layout.pk}/').json()['srcset']
+
+    def test_pdf_preview_is_built_from_first_page(self):
+        layout = create_layout(pdf=pdf_file(pages=2))
+        self.assertIsNone(self.srcset(layout)['pdf'])
+
+        # Сохранение объекта задачей сбрасывает закэшированный ответ после коммита
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(generate_image_variants('residence.layout', layout.pk), ['pdf'])
+        layout.refresh_from_db()
+        entry = layout.image_variants['pdf']
+        self.assertEqual(set(entry['webp']), {'320', '640', '1280'})
+        self.assertTrue(all(default_storage.exists(name) for name in entry['jpeg'].values()))
+        self.assertIn(' 1280w', self.srcset(layout)['pdf']['jpeg'])
+
+    def test_broken_file_does_not_block_other_fields(self):
+        layout = create_layout(pdf=SimpleUploadedFile('broken.pdf', b'not a pdf'),
+                               preview=image_file('preview.png', size=(500, 300)))
+        with self.assertLogs('residence.tasks', level='ERROR'):
+            generate_image_variants('residence.layout', layout.pk)
+        layout.refresh_from_db()
+        self.assertEqual(set(layout.image_variants['preview']['webp']), {'320', '500'})
+        self.assertEqual(layout.image_variants['pdf'], {'source': layout.pdf.name})
+
+        srcset = self.srcset(layout)
+        self.assertIsNone(srcset['pdf'])
+        self.assertIn(' 500w', srcset['preview']['webp'])
+        # Источник запомнен - повторный запуск не трогает битый файл
+        self.assertEqual(generate_image_variants('residence.layout', layout.pk), [])
+
+
+class CompressionTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        for index in range(20):
+            create_tree(clusters=0, title=f'Жилой комплекс {index}')
+
+    def get(self, accept_encoding):
+        return self.client.get('/residences/', HTTP_ACCEPT_ENCODING=accept_encoding)
+
+    def test_brotli_is_preferred(self):
+        for _ in range(2):
+            # Второй ответ - из кэша с заранее сжатыми вариантами
+            response = self.get('gzip, deflate, br')
+            self.assertEqual(response['Content-Encoding'], 'br')
+            self.assertIn('Accept-Encoding', response['Vary'])
+            self.assertEqual(len(json.loads(brotli.decompress(response.content))['results']), 10)
+
+    def test_gzip_when_brotli_is_not_accepted(self):
+        for accept_encoding in ('gzip', 'gzip, br;q=0'):
+            response = self.get(accept_encoding)
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(len(json.loads(gzip.decompress(response.content))['results']), 10)
+
+    def test_identity_without_accept_encoding(self):
+        response = self.get('')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(len(response.json()['results']), 10)
+
+    def test_non_json_is_not_compressed(self):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip, br')
+        middleware = CompressionMiddleware(lambda request: HttpResponse('<p>x</p>' * 500, content_type='text/html'))
+        response = middleware(request)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, b'<p>x</p>' * 500)
+
+        response = self.client.get('/residences/', HTTP_ACCEPT='text/html', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        self.assertFalse(response.has_header('Content-Encoding'))
@@ -0,0 +1,117 @@
+import hashlib
+import io
+import math
+import posixpath
+
+from PIL import Image, ImageOps
+
+from django.core.files.base import ContentFile
+
+from .images import render_pdf_page
+
+# Параметры пирамиды тайлов в формате Deep Zoom (DZI)
+TILE_SIZE = 256
+TILE_OVERLAP = 1
+TILE_PDF_DPI = 200
+TILE_FORMATS = {
+    'jpeg': {'format': 'JPEG', 'quality': 85},
+    'png': {'format': 'PNG', 'optimize': True},
+}
+
+
+def pending_tile_fields(instance):
+    """Поля, для которых пирамида не построена или построена по старому файлу"""
+    pending = []
+    for field_name in instance.tiled_fields:
+        file = getattr(instance, field_name)
+        entry = instance.tile_pyramids.get(field_name) or {}
+        if (file.name or None) != entry.get('source'):
+            pending.append(field_name)
+    return pending
+
+
+def open_source_image(file):
+    """Открывает план как растровое изображение; для PDF - первая страница, None без PyMuPDF"""
+    extension = posixpath.splitext(file.name)[1].lower()
+    if extension == '.pdf':
+        return render_pdf_page(file, dpi=TILE_PDF_DPI)
+
+    with file.open('rb'):
+        if extension == '.svg':
+            from reportlab.graphics import renderPM
+            from svglib.svglib import svg2rlg
+            return renderPM.drawToPIL(svg2rlg(io.BytesIO(file.read())))
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    return image
+
+
+def tile_path(instance, field_name, source):
+    digest = hashlib.md5(source.encode()).hexdigest()[:8]
+    return posixpath.join('tiles', instance._meta.label_lower.replace('.', '_'), str(instance.pk), field_name, digest)
+
+
+def tile_name(entry, level, col, row):
+    return posixpath.join(entry['path'], str(level), f"{col}_{row}.{entry['format']}")
+
+
+def delete_pyramid(storage, entry):
+    if not entry.get('path'):
+        return
+    for level in range(entry['max_level'] + 1):
+        directory = posixpath.join(entry['path'], str(level))
+        try:
+            _, files = storage.listdir(directory)
+        except FileNotFoundError:
+            continue
+        for name in files:
+            storage.delete(posixpath.join(directory, name))
+
+
+def build_pyramid(instance, field_name):
+    """Режет план на тайлы TILE_SIZE для всех уровней приближения и возвращает запись для tile_pyramids"""
+    file = getattr(instance, field_name)
+    delete_pyramid(file.storage, instance.tile_pyramids.get(field_name) or {})
+
+    if not file.name:
+        return None
+
+    image = open_source_image(file)
+    if image is None:
+        return {'source': file.name, 'path': None}
+
+    has_alpha = 'A' in image.mode or 'transparency' in image.info
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    extension = 'png' if has_alpha else 'jpeg'
+
+    entry = {
+        'source': file.name,
+        'path': tile_path(instance, field_name, file.name),
+        'width': image.width,
+        'height': image.height,
+        'tile_size': TILE_SIZE,
+        'overlap': TILE_OVERLAP,
+        'format': extension,
+        'max_level': math.ceil(math.log2(max(image.width, image.height, 1))),
+    }
+
+    # Остатки прерванной сборки по тому же файлу
+    delete_pyramid(file.storage, entry)
+
+    # От самого детального уровня к 1x1, каждый следующий вдвое меньше предыдущего
+    level_image = image
+    for level in range(entry['max_level'], -1, -1):
+        for col in range(math.ceil(level_image.width / TILE_SIZE)):
+            for row in range(math.ceil(level_image.height / TILE_SIZE)):
+                left = max(col * TILE_SIZE - TILE_OVERLAP, 0)
+                top = max(row * TILE_SIZE - TILE_OVERLAP, 0)
+                right = min((col + 1) * TILE_SIZE + TILE_OVERLAP, level_image.width)
+                bottom = min((row + 1) * TILE_SIZE + TILE_OVERLAP, level_image.height)
+
+                buffer = io.BytesIO()
+                level_image.crop((left, top, right, bottom)).save(buffer, **TILE_FORMATS[extension])
+                file.storage.save(tile_name(entry, level, col, row), ContentFile(buffer.getvalue()))
+
+        size = (max(math.ceil(level_image.width / 2), 1), max(math.ceil(level_image.height / 2), 1))
+        level_image = level_image.resize(size, Image.LANCZOS)
+    return entry
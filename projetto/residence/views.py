@@ -1,39 +1,59 @@
-from rest_framework import viewsets, status, filters
+from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, AllowAny, IsAuthenticated
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.exceptions import ParseError, NotFound
 
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 
-from .models import Residence, Apartment, Attachment, Cluster, Floor, Layout, City
+from .models import Residence, Apartment, Attachment, Cluster, Floor, FloorNumber, Layout, City, ResidenceTreeSnapshot
 from .serializers import ResidenceSerializer, ApartmentSerializer, AttachmentSerializer, ClusterSerializer, FloorSerializer \
                         ,LayoutSerializer, CitySerializer \
-                        ,LayoutRetrieveSerializer
+                        ,LayoutRetrieveSerializer, get_requested_fields \
+                        ,ApartmentSearchSerializer, ApartmentSearchParamsSerializer, ApartmentBulkSerializer
+from .snapshots import build_tree_snapshots, TREE_VERSIONS, TREE_DEFAULT_VERSION
+from .mixins import ConditionalGetMixin, BulkRetrieveMixin, TilesMixin
+from .cache import CachedResponseMixin
+from .search import RankedSearchFilter
+from .facets import ApartmentFacetSearch, ORDERINGS
+
+from app.pagination import HybridPagination, OptionalHybridPagination
+from app.sendfile import sendfile
+from app.signing import sign_file_url
+from app.compression import precompressed_response
 
 from django_filters.rest_framework import DjangoFilterBackend
 
-from django.db.models import Q
-class ResidenceViewSet(viewsets.ReadOnlyModelViewSet):
+class ResidenceViewSet(TilesMixin, ConditionalGetMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     allowed_methods = ['get'] 
     queryset = Residence.objects.all()
+    lookup_value_regex = r'\d+'
     serializer_class = ResidenceSerializer
     permission_classes = [AllowAny]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    filter_backends = [DjangoFilterBackend, RankedSearchFilter]
     filterset_fields = ['city']
-    search_fields = ['title', '^title', '=title']
+    conditional_related = ('attachment', 'city')
+    cache_models = (Residence, City, Attachment)
+    search_fields = ['title', 'city__name']
+    tiled_field = 'gen_plan'
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-        search_query = self.request.query_params.get('search', None)
-        if search_query:
-            queryset = queryset.filter(
-                Q(title__icontains=search_query) |
-                Q(title__iexact=search_query) |
-                Q(city__name__icontains=search_query)
-            )
+        queryset = super().get_queryset().select_related('city')
+        requested = get_requested_fields(self.request)
+        if self.action in ('list', 'retrieve') and (requested is None or 'attachments' in requested):
+            queryset = queryset.prefetch_related('attachment_set')
         return queryset
+
+    @swagger_auto_schema(manual_parameters=[
+        openapi.Parameter('search', openapi.IN_QUERY, description="Начало названия ЖК", type=openapi.TYPE_STRING),
+    ])
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """Подсказки названий ЖК для поиска по мере ввода"""
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(list(queryset.values('id', 'title')[:10]))
     
     @action(detail=True, methods=['get'])
     def clusters(self, request, pk=None):
@@ -43,39 +63,30 @@ class ResidenceViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = ClusterSerializer(clusters, many=True)
         return Response(serializer.data)
     
+    @swagger_auto_schema(manual_parameters=[
+        openapi.Parameter('version', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                          description="1 - список пятен (по умолчанию), 2 - ЖК с вложениями и планировками"),
+    ])
     @action(detail=True, methods=['get'])
     def get_residence_tree(self, request, pk=None):
         """Возвращает дерево квартир в формате JSON"""
-        residence = self.get_object()
-        clusters = residence.clusters.all()
+        version = request.query_params.get('version', str(TREE_DEFAULT_VERSION))
+        if not version.isdigit() or int(version) not in TREE_VERSIONS:
+            raise ParseError(f'version must be one of {sorted(TREE_VERSIONS)}.')
+        version = int(version)
+
+        # Дерево собирается в фоне при изменении каталога, здесь отдаём готовый JSON
+        snapshot = ResidenceTreeSnapshot.objects.filter(residence_id=pk, version=version).first()
+        if snapshot is None:
+            residence = self.get_object()
+            snapshot = build_tree_snapshots(residence.pk)[version]
+        variants = {'identity': bytes(snapshot.data)}
+        for encoding, data in (('gzip', snapshot.data_gzip), ('br', snapshot.data_br)):
+            if data is not None:
+                variants[encoding] = bytes(data)
+        return precompressed_response(request, variants, 'application/json')
 
-        tree = []
-        for cluster in clusters:
-            floors = cluster.floors.all()
-            floors_list = []
-            for floor in floors:
-                apartments = floor.apartments.all()
-                apartments_list = []
-                for apartment in apartments:
-                    apartments_list.append({
-                        'id': apartment.id,
-                        'room_number': apartment.room_number,
-                        'area': apartment.area,
-                    })
-                floors_list.append({
-                    'id': floor.id,
-                    'floor_numbers': floor.floor_numbers,
-                    'apartments': apartments_list
-                })
-            tree.append({
-                'id': cluster.id,
-                'name': cluster.name,
-                'floors': floors_list,
-            })
-
-        return Response(tree)
-
-class ClusterViewSet(viewsets.ReadOnlyModelViewSet):
+class ClusterViewSet(BulkRetrieveMixin, ConditionalGetMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Cluster.objects.all()
     serializer_class = ClusterSerializer
     permission_classes = [AllowAny]
@@ -88,10 +99,13 @@ class ClusterViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = FloorSerializer(floors, many=True)
         return Response(serializer.data)
 
-class FloorViewSet(viewsets.ReadOnlyModelViewSet):
+class FloorViewSet(TilesMixin, ConditionalGetMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Floor.objects.all()
     serializer_class = FloorSerializer
     permission_classes = [AllowAny]
+    pagination_class = None
+    cache_models = (Floor, Cluster)
+    tiled_field = 'scheme'
     
     @action(detail=True, methods=['get'])
     def apartments(self, request, pk=None):
@@ -100,39 +114,76 @@ class FloorViewSet(viewsets.ReadOnlyModelViewSet):
         apartments = floor.apartments.all()
         serializer = ApartmentSerializer(apartments, many=True)
         return Response(serializer.data)
+
+    @swagger_auto_schema(manual_parameters=[
+        openapi.Parameter('cluster_id', openapi.IN_QUERY, description="ID of the cluster", type=openapi.TYPE_INTEGER),
+        openapi.Parameter('floor_number', openapi.IN_QUERY, description="Floor number", type=openapi.TYPE_INTEGER),
+    ])
+    @action(detail=False, methods=['get'])
+    def lookup(self, request):
+        """Возвращает этаж пятна по номеру этажа"""
+        cluster_id = request.query_params.get('cluster_id')
+        floor_number = request.query_params.get('floor_number')
+
+        if not (cluster_id and floor_number):
+            raise ParseError('cluster_id and floor_number query params are required.')
+        if not (cluster_id.isdigit() and floor_number.lstrip('-').isdigit()):
+            raise ParseError('cluster_id and floor_number must be numbers.')
+
+        # Один запрос по индексу (cluster, number)
+        entry = FloorNumber.objects.select_related('floor').filter(cluster_id=cluster_id, number=floor_number).first()
+        if entry is None:
+            raise NotFound('Floor not found.')
+
+        serializer = FloorSerializer(entry.floor, context={'request': request})
+        return Response(serializer.data)
     
     @swagger_auto_schema(manual_parameters=[
         openapi.Parameter('residence_id', openapi.IN_QUERY, description="ID of the residence", type=openapi.TYPE_INTEGER),
         openapi.Parameter('cluster_id', openapi.IN_QUERY, description="ID of the cluster", type=openapi.TYPE_INTEGER),
+        openapi.Parameter('floor_number', openapi.IN_QUERY, description="Floor number (optional)", type=openapi.TYPE_INTEGER),
     ])
     def list(self, request, *args, **kwargs):
         """Возвращает список этажей, отфильтрованных по переданным параметрам"""
+        return super().list(request, *args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action != 'list':
+            return queryset
+
         # Получаем переданные параметры из запроса
-        residence_id = request.query_params.get('residence_id')
-        cluster_id = request.query_params.get('cluster_id')
+        residence_id = self.request.query_params.get('residence_id')
+        cluster_id = self.request.query_params.get('cluster_id')
+        floor_number = self.request.query_params.get('floor_number')
 
         # Проверяем, что оба параметра переданы
         if not (residence_id and cluster_id):
-            return Response({'detail': 'residence_id and cluster_id query params are required.'}, status=status.HTTP_400_BAD_REQUEST)
+            raise ParseError('residence_id and cluster_id query params are required.')
 
-        # Получаем соответствующий Residence и Cluster
-        try:
-            residence = Residence.objects.get(id=residence_id)
-            cluster = Cluster.objects.get(id=cluster_id, residence_id=residence)
-        except (Residence.DoesNotExist, Cluster.DoesNotExist):
-            return Response({'detail': 'Residence or Cluster not found.'}, status=status.HTTP_404_NOT_FOUND)
+        # Проверяем, что пятно принадлежит ЖК
+        if not Cluster.objects.filter(id=cluster_id, residence_id=residence_id).exists():
+            raise NotFound('Residence or Cluster not found.')
 
         # Фильтруем этажи по переданным параметрам
-        floors = self.queryset.filter(clusters__in=[cluster])
+        if floor_number:
+            if not floor_number.lstrip('-').isdigit():
+                raise ParseError('floor_number must be a number.')
+            return queryset.filter(numbers__cluster_id=cluster_id, numbers__number=floor_number)
+        return queryset.filter(clusters=cluster_id)
 
-        # Сериализуем и возвращаем результат
-        serializer = self.serializer_class(floors, many=True)
-        return Response(serializer.data)
-
-class ApartmentViewSet(viewsets.ReadOnlyModelViewSet):
+class ApartmentViewSet(BulkRetrieveMixin, ConditionalGetMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Apartment.objects.all()
     serializer_class = ApartmentSerializer
     permission_classes = [AllowAny]
+    # Список квартир этажа клиенты получают целиком; постранично - по ?page= или ?pagination=cursor
+    pagination_class = OptionalHybridPagination
+    cursor_ordering = 'id'
+    cache_models = (Apartment, Floor, Cluster)
+    filter_backends = [RankedSearchFilter]
+    search_fields = ['door_number', 'name']
+    bulk_prefetch = ('layouts',)
+    bulk_serializer_class = ApartmentBulkSerializer
 
     @action(detail=True, methods=['get'])
     def layouts(self, request, pk=None):
@@ -141,44 +192,76 @@ class ApartmentViewSet(viewsets.ReadOnlyModelViewSet):
         layouts = apartment.layouts.all()
         serializer = LayoutSerializer(layouts, many=True)
         return Response(serializer.data)
+
+    @swagger_auto_schema(query_serializer=ApartmentSearchParamsSerializer)
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Фасетный поиск квартир по комнатам, площади, цене, ЖК и городу"""
+        params = ApartmentSearchParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        facet_search = ApartmentFacetSearch(params.validated_data)
+
+        ordering = ORDERINGS.get(params.validated_data.get('ordering'), 'id')
+        paginator = HybridPagination(cursor_ordering=(ordering, 'id'))
+        # min_price бывает NULL, по нему курсор не построить
+        if paginator.is_cursor_mode(request) and ordering.lstrip('-') == 'min_price':
+            raise ParseError('ordering by price is not supported with cursor pagination.')
+        page = paginator.paginate_queryset(facet_search.results(), request, view=self)
+        serializer = ApartmentSearchSerializer(page, many=True, context={'request': request})
+
+        response = paginator.get_paginated_response(serializer.data)
+        response.data['facets'] = facet_search.facets()
+        return response
     
     @swagger_auto_schema(manual_parameters=[
         openapi.Parameter('residence_id', openapi.IN_QUERY, description="ID of the residence", type=openapi.TYPE_INTEGER),
         openapi.Parameter('cluster_id', openapi.IN_QUERY, description="ID of the cluster", type=openapi.TYPE_INTEGER),
         openapi.Parameter('floor_id', openapi.IN_QUERY, description="ID of the floor", type=openapi.TYPE_INTEGER),
+        openapi.Parameter('floor_number', openapi.IN_QUERY, description="Floor number, instead of floor_id", type=openapi.TYPE_INTEGER),
     ])
     def list(self, request, *args, **kwargs):
         """Возвращает список квартир, отфильтрованных по переданным параметрам"""
-        # Получаем переданные параметры из запроса
-        residence_id = request.query_params.get('residence_id')
-        cluster_id = request.query_params.get('cluster_id')
-        floor_id = request.query_params.get('floor_id')
+        return super().list(request, *args, **kwargs)
 
-        # Проверяем, что оба параметра переданы
-        if not (residence_id and cluster_id and floor_id):
-            return Response({'detail': 'residence_id and cluster_id and floor_id query params are required.'}, status=status.HTTP_400_BAD_REQUEST)
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action != 'list':
+            return queryset
 
-        # Получаем соответствующий Residence и Cluster
-        try:
-            residence = Residence.objects.get(id=residence_id)
-            cluster = Cluster.objects.get(id=cluster_id, residence_id=residence)
-            floor = Floor.objects.get(id=floor_id, cluster_id=cluster)
-        except (Residence.DoesNotExist, Cluster.DoesNotExist, Floor.DoesNotExist):
-            return Response({'detail': 'Residence or Cluster or Floor not found.'}, status=status.HTTP_404_NOT_FOUND)
+        # Получаем переданные параметры из запроса
+        residence_id = self.request.query_params.get('residence_id')
+        cluster_id = self.request.query_params.get('cluster_id')
+        floor_id = self.request.query_params.get('floor_id')
+        floor_number = self.request.query_params.get('floor_number')
 
-        # Фильтруем этажи по переданным параметрам
-        apartments = self.queryset.filter(floor_id=floor)
+        # Проверяем, что все параметры переданы
+        if not (residence_id and cluster_id and (floor_id or floor_number)):
+            raise ParseError('residence_id and cluster_id and floor_id (or floor_number) query params are required.')
 
-        # Сериализуем и возвращаем результат
-        serializer = self.serializer_class(apartments, many=True)
+        if floor_id:
+            # Проверяем, что этаж относится к пятну этого ЖК
+            if not Floor.objects.filter(id=floor_id, clusters=cluster_id, clusters__residence_id=residence_id).exists():
+                raise NotFound('Residence or Cluster or Floor not found.')
+        else:
+            if not floor_number.lstrip('-').isdigit():
+                raise ParseError('floor_number must be a number.')
+            # Находим этаж по номеру одним запросом по индексу (cluster, number)
+            floor_id = FloorNumber.objects.filter(cluster_id=cluster_id, cluster__residence_id=residence_id, number=floor_number) \
+                                          .values_list('floor_id', flat=True).first()
+            if floor_id is None:
+                raise NotFound('Residence or Cluster or Floor not found.')
 
-        return Response(serializer.data)
+        # Фильтруем квартиры по переданным параметрам
+        return queryset.filter(floor_id=floor_id)
 
-class LayoutViewSet(viewsets.ReadOnlyModelViewSet):
+class LayoutViewSet(BulkRetrieveMixin, ConditionalGetMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Layout.objects.all()
     serializer_class = LayoutSerializer
     parser_classes = [MultiPartParser, FormParser]
     permission_classes = [AllowAny]
+    filter_backends = [RankedSearchFilter]
+    search_fields = ['name']
+    cursor_ordering = 'id'
 
     def get_serializer_class(self):
         if self.action == 'retrieve':
@@ -190,13 +273,30 @@ class LayoutViewSet(viewsets.ReadOnlyModelViewSet):
             return [IsAuthenticated()]
         return super().get_permissions()
 
+    @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
+    def pdf(self, request, pk=None):
+        """Скачивание PDF планировки (только для авторизованных)"""
+        layout = self.get_object()
+        if not layout.pdf:
+            raise NotFound('Layout has no pdf.')
+        return sendfile(request, layout.pdf)
+
+    @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
+    def pdf_url(self, request, pk=None):
+        """Короткоживущая подписанная ссылка на PDF планировки"""
+        layout = self.get_object()
+        if not layout.pdf:
+            raise NotFound('Layout has no pdf.')
+        url, expires = sign_file_url(request, layout.pdf, filename=f'layout-{layout.pk}.pdf')
+        return Response({'url': url, 'expires': expires})
+
 class AttachmentViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Attachment.objects.all()
     serializer_class = AttachmentSerializer
     parser_classes = [MultiPartParser, FormParser]
     permission_classes = [AllowAny]
 
-class CityViewSet(viewsets.ReadOnlyModelViewSet):
+class CityViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = City.objects.all()
     serializer_class = CitySerializer
     permission_classes = [AllowAny]
@@ -1,10 +1,28 @@
 from django.contrib import admin
 
+from django.urls import reverse
+
 from .models import User, Order, Ticket, TicketAttachment, SMSMessage
+from .tasks import start_docs_batch
 # Register your models here.
 
 admin.site.register(User)
-admin.site.register(Order)
+
+
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'flat_layout', 'status', 'created_at']
+    list_filter = ['status']
+    actions = ['regenerate_docs']
+
+    @admin.action(description='Перегенерировать договоры')
+    def regenerate_docs(self, request, queryset):
+        batch_id = start_docs_batch(queryset.values_list('id', flat=True))
+        if batch_id is None:
+            return
+        url = reverse('order-docs-batch') + f'?batch_id={batch_id}'
+        self.message_user(request, f'Генерация запущена для {queryset.count()} заказов, прогресс: {url}')
+
+admin.site.register(Order, OrderAdmin)
 admin.site.register(Ticket)
 admin.site.register(TicketAttachment)
 
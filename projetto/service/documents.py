@@ -0,0 +1,111 @@
+import copy
+import hashlib
+import io
+import json
+from functools import lru_cache
+
+from django.conf import settings
+
+from PyPDF2 import PdfFileReader, PdfFileWriter
+from reportlab.lib.pagesizes import A2
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+FONT_NAME = 'OpenSans'
+FONT_PATH = settings.BASE_DIR / 'utils' / 'opensans.ttf'
+TITLE_TEMPLATE_PATH = settings.BASE_DIR / 'utils' / 'projetto_titul.pdf'
+DOCS_PREFIX = 'docs/'
+
+ROOM_COUNTS = {
+    1: "Однокомнатная квартира",
+    2: "Двухкомнатная квартира",
+    3: "Трёхкомнатная квартира",
+    4: "Четырёхкомнатная квартира",
+}
+
+
+def room_count_title(room_number):
+    return ROOM_COUNTS.get(room_number, f"{room_number}-комнатная квартира")
+
+
+class DocumentRenderer:
+    """
+    Титульный лист договора: шрифт регистрируется, а шаблон читается и разбирается один раз,
+    для каждого заказа копируется только страница шаблона, на которую накладывается текст.
+    version - хэш шаблона и шрифта, входит в ключ документа (document_name).
+    """
+
+    def __init__(self, template_path=TITLE_TEMPLATE_PATH, font_path=FONT_PATH):
+        with open(font_path, 'rb') as file:
+            font_data = file.read()
+        if FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(FONT_NAME, io.BytesIO(font_data)))
+
+        # Шаблон целиком в памяти, файл сразу закрывается
+        with open(template_path, 'rb') as file:
+            template_data = file.read()
+        self.template = PdfFileReader(io.BytesIO(template_data))
+        self.template_page = self.template.pages[0]
+        self.version = hashlib.sha256(template_data + font_data).hexdigest()[:16]
+
+    @staticmethod
+    def draw(can, text, x, y, font_size):
+        can.setFont(FONT_NAME, font_size)
+        can.setFillColorRGB(0.85, 0.85, 0.85)
+        can.drawCentredString(x, y, text)
+
+    def render_overlay(self, lines):
+        packet = io.BytesIO()
+        can = canvas.Canvas(packet, pagesize=A2)
+        for text, x, y, font_size in lines:
+            self.draw(can, text, x, y, font_size)
+        can.save()
+        packet.seek(0)
+        return PdfFileReader(packet).pages[0]
+
+    def render(self, lines, output):
+        """Пишет в output шаблон с наложенными строками lines: [(text, x, y, font_size), ...]"""
+        # merge_page заменяет /Contents и /Resources у страницы, поэтому поверхностной копии достаточно,
+        # а разобранная страница шаблона остаётся нетронутой
+        page = copy.copy(self.template_page)
+        page.merge_page(self.render_overlay(lines))
+
+        writer = PdfFileWriter()
+        writer.add_page(page)
+        writer.write(output)
+
+    @staticmethod
+    def order_lines(order):
+        residence = order.cluster.residence_id
+        layout = order.flat_layout
+        code = f"{residence.slug}/{order.cluster.name}/{layout.room_number}.{layout.variant}/{layout.type_of_apartment}"
+        return [
+            ('Рабочий проект дизайн интерьера', 600, 390, 24),
+            (residence.title, 600, 325, 38),
+            (f"{room_count_title(order.apartment.room_number)}: {code}", 600, 275, 28),
+            (order.user.full_name, 975, 85, 24),
+        ]
+
+    def document_name(self, lines):
+        """Имя файла по хэшу входных данных: одинаковый текст на той же версии шаблона - тот же файл"""
+        digest = hashlib.sha256(json.dumps([self.version, lines], ensure_ascii=False).encode()).hexdigest()
+        return f'{DOCS_PREFIX}{digest[:2]}/{digest}.pdf'
+
+
+def save_named(storage, name, content):
+    """
+    Сохраняет content ровно под name (имя - хэш входных данных). Если между exists() и save()
+    тот же файл записал другой воркер, хранилище вернёт имя с суффиксом: копию удаляем
+    и используем уже записанный файл с тем же содержимым.
+    """
+    saved = storage.save(name, content)
+    if saved != name:
+        storage.delete(saved)
+    return name
+
+
+@lru_cache(maxsize=None)
+def get_renderer():
+    """Один рендерер на процесс (воркер Celery / gunicorn), создаётся при первом документе"""
+    return DocumentRenderer()
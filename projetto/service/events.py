@@ -0,0 +1,62 @@
+import asyncio
+import json
+from functools import lru_cache
+
+import redis
+import redis.asyncio as aioredis
+
+from django.conf import settings
+
+# Канал pub/sub и ключ с результатом завершённой задачи генерации документа
+TASK_DONE_KEY = 'tasks:done:{}'
+TASK_DONE_TIMEOUT = 60 * 60
+
+
+@lru_cache(maxsize=None)
+def get_redis():
+    return redis.Redis.from_url(settings.REDIS_URL)
+
+
+def publish_task_result(task_id, state, result):
+    """Вызывается воркером по завершении задачи: сохраняет результат и оповещает подписчиков"""
+    key = TASK_DONE_KEY.format(task_id)
+    message = json.dumps({'state': state, 'result': result if state == 'SUCCESS' else None})
+    client = get_redis()
+    # Ключ нужен тем, кто подключится уже после публикации
+    client.set(key, message, ex=TASK_DONE_TIMEOUT)
+    client.publish(key, message)
+
+
+async def task_events(task_id, timeout, heartbeat):
+    """
+    Асинхронный генератор для SSE / long-poll: отдаёт None после каждых heartbeat секунд ожидания
+    и результат задачи ({'state', 'result'}), когда она завершится. Через timeout секунд заканчивается.
+    На всё ожидание держится одно соединение с Redis.
+    """
+    key = TASK_DONE_KEY.format(task_id)
+    client = aioredis.from_url(settings.REDIS_URL)
+    pubsub = client.pubsub()
+    try:
+        # Сначала подписка, потом проверка ключа: публикация между ними не потеряется
+        await pubsub.subscribe(key)
+        message = await client.get(key)
+        if message is not None:
+            yield json.loads(message)
+            return
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        next_heartbeat = loop.time() + heartbeat
+        while loop.time() < deadline:
+            wait = min(deadline, next_heartbeat) - loop.time()
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=max(wait, 0))
+            if message is not None:
+                yield json.loads(message['data'])
+                return
+            if loop.time() >= next_heartbeat:
+                next_heartbeat += heartbeat
+                yield None
+    finally:
+        await pubsub.unsubscribe(key)
+        await pubsub.close()
+        await client.close()
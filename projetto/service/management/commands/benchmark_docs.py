@@ -0,0 +1,58 @@
+import io
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+from service.documents import FONT_NAME, FONT_PATH, DocumentRenderer
+from service.models import Order
+
+SAMPLE_LINES = [
+    ('Рабочий проект дизайн интерьера', 600, 390, 24),
+    ('ЖК Тестовый', 600, 325, 38),
+    ('Двухкомнатная квартира: test/A/2.1/A', 600, 275, 28),
+    ('Иванов Иван', 975, 85, 24),
+]
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время генерации титульного листа договора: '
+            'с загрузкой шрифта и шаблона на каждый документ (как раньше) и с общим рендерером')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=50)
+        parser.add_argument('--order-id', type=int, help='Брать текст из заказа, иначе тестовые строки')
+
+    def handle(self, *args, **options):
+        lines = SAMPLE_LINES
+        if options['order_id']:
+            order = Order.objects.select_related(
+                'user', 'apartment', 'flat_layout', 'cluster__residence_id').filter(pk=options['order_id']).first()
+            if order is None:
+                raise CommandError(f"Order {options['order_id']} not found")
+            lines = DocumentRenderer.order_lines(order)
+
+        def cold():
+            # Прежнее поведение generate_doc: регистрация шрифта и разбор шаблона на каждый документ
+            pdfmetrics.registerFont(TTFont(FONT_NAME, str(FONT_PATH)))
+            DocumentRenderer().render(lines, io.BytesIO())
+
+        renderer = DocumentRenderer()
+
+        def warm():
+            renderer.render(lines, io.BytesIO())
+
+        for title, render in (('Без кэша', cold), ('С общим рендерером', warm)):
+            timings = []
+            for _ in range(options['count']):
+                started = time.perf_counter()
+                render()
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            self.stdout.write(
+                f"{title}: среднее {statistics.mean(timings):.1f} мс, медиана {statistics.median(timings):.1f} мс, "
+                f"p95 {timings[int(len(timings) * 0.95) - 1]:.1f} мс"
+            )
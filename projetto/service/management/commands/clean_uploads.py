@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from service.models import UploadSession
+from service.uploads import delete_parts
+
+
+class Command(BaseCommand):
+    help = 'Удаляет брошенные и завершённые сессии загрузки вместе с кусками файлов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-hours', type=int, default=24)
+
+    def handle(self, *args, **options):
+        threshold = timezone.now() - timedelta(hours=options['older_than_hours'])
+        sessions = UploadSession.objects.filter(updated_at__lt=threshold)
+        deleted = 0
+        for session in sessions.iterator():
+            delete_parts(session)
+            session.delete()
+            deleted += 1
+        self.stdout.write(self.style.SUCCESS(f'Удалено сессий: {deleted}'))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from service.models import Order
+from service.tasks import DOCS_CHUNK_SIZE, start_docs_batch, docs_batch_progress
+
+
+class Command(BaseCommand):
+    help = 'Перегенерирует договоры заказов пачками через группу задач Celery'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', default='paid', help='Статус заказов (по умолчанию paid)')
+        parser.add_argument('--all', action='store_true', help='Все заказы независимо от статуса')
+        parser.add_argument('--chunk-size', type=int, default=DOCS_CHUNK_SIZE)
+        parser.add_argument('--wait', action='store_true', help='Ждать завершения и выводить прогресс')
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all() if options['all'] else Order.objects.filter(status=options['status'])
+        batch_id = start_docs_batch(orders.order_by('id').values_list('id', flat=True), options['chunk_size'])
+        if batch_id is None:
+            self.stdout.write('Нет заказов для генерации')
+            return
+        self.stdout.write(f'Запущена группа {batch_id}')
+        if not options['wait']:
+            return
+
+        while True:
+            progress = docs_batch_progress(batch_id)
+            self.stdout.write(f"Готово {progress['done']}/{progress['total']}, ошибок {len(progress['failed'])}, "
+                              f"пачек {progress['chunks_ready']}/{progress['chunks']}")
+            if progress['ready']:
+                break
+            time.sleep(2)
+
+        if progress['failed']:
+            self.stdout.write(self.style.WARNING(f"Не удалось: {progress['failed']}"))
+        self.stdout.write(self.style.SUCCESS('Генерация завершена'))
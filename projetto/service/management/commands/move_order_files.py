@@ -0,0 +1,32 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from app.sendfile import protected_storage
+from service.models import Order
+
+
+class Command(BaseCommand):
+    help = ('Переносит договоры и пакеты проектов из MEDIA_ROOT в PROTECTED_MEDIA_ROOT, '
+            'чтобы они не раздавались по /media/. Имена файлов не меняются')
+
+    def handle(self, *args, **options):
+        names = set()
+        orders = Order.objects.filter(~Q(doc='') & Q(doc__isnull=False) | ~Q(package='') & Q(package__isnull=False))
+        for doc, package in orders.values_list('doc', 'package').iterator():
+            names.update(name for name in (doc, package) if name)
+
+        moved = 0
+        for name in sorted(names):
+            if protected_storage.exists(name) or not default_storage.exists(name):
+                continue
+            with default_storage.open(name, 'rb') as file:
+                saved = protected_storage.save(name, file)
+            if saved != name:
+                # Поле заказа хранит старое имя - файл должен лечь ровно под ним
+                protected_storage.delete(saved)
+                self.stdout.write(self.style.WARNING(f'{name}: не удалось сохранить под тем же именем'))
+                continue
+            default_storage.delete(name)
+            moved += 1
+        self.stdout.write(self.style.SUCCESS(f'Перенесено файлов: {moved}'))
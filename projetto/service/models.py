@@ -1,21 +1,15 @@
-from django.utils import timezone
-from datetime import datetime
-
 from django.db import models
 from django.contrib.auth.models import AbstractUser,UserManager
-from django.core.files.storage import default_storage
+from django.core.files.base import ContentFile
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
-from residence.models import Residence, Apartment, Layout, Cluster, Floor
+from django.urls import reverse
+from residence.storage import content_addressed_storage, BlobReferencesMixin
+from app.sendfile import protected_storage
 from .managers import UserManager
+from .documents import get_renderer, save_named
 
-import os
-
-from PyPDF2 import PdfFileWriter, PdfFileReader
 import io
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A2
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+import uuid
 
 class Timestamp(models.Model):
     created_at = models.DateTimeField("Создано", auto_now_add=True)
@@ -50,71 +44,39 @@ class Order(models.Model):
     flat_layout = models.ForeignKey("residence.Layout", verbose_name="ID Планировки", on_delete=models.CASCADE)
     apartment = models.ForeignKey("residence.Apartment", verbose_name="ID Квартиры", on_delete=models.CASCADE)
     cluster = models.ForeignKey("residence.Cluster", verbose_name="ID Кластера", on_delete=models.CASCADE)
-    doc = models.FileField("Договор", upload_to='docs/',null=True, blank=True)
+    # Платные файлы: вне MEDIA_ROOT, скачиваются только через /orders/{id}/doc/ и /orders/{id}/package/
+    doc = models.FileField("Договор", upload_to='docs/', storage=protected_storage, null=True, blank=True)
+    package = models.FileField("Пакет проекта", upload_to='packages/', storage=protected_storage, null=True, blank=True)
     status = models.CharField("Статус", max_length=20, choices=STATUS_CHOICES, default='created')
     created_at = models.DateTimeField("Создано", auto_now_add=True)
     updated_at = models.DateTimeField("Изменено", auto_now_add=True)
 
-    @staticmethod
-    def draw(can, text, x, y, font_size):
-        can.setFont('OpenSans', font_size)
-        can.setFillColorRGB(0.85, 0.85, 0.85)
-        text_width = can.stringWidth(text, 'OpenSans', font_size)
-        text_height = font_size
-        y = y 
-        x = x
-        can.drawCentredString(x, y, text)
-
-    
-    def generate_doc(self):
-        residence:Residence = self.cluster.residence_id
-        cluster:Cluster = self.cluster
-        apartment: Apartment = self.apartment
-        layout: Layout = self.flat_layout
-
-        current_year = datetime.now(tz=timezone.get_current_timezone()).year
-
-        match apartment.room_number:
-            case 1: room_count = "Однокомнатная квартира"
-            case 2: room_count = "Двухкомнатная квартира"
-            case 3: room_count = "Трёхкомнатная квартира"
-            case 4: room_count = "Четырёхкомнатная квартира"
-            case _: room_count = apartment.room_number + "-комнатная квартира"
-
-        pdfmetrics.registerFont(TTFont('OpenSans', './utils/opensans.ttf'))
-
-        packet = io.BytesIO()
-
-        can = canvas.Canvas(packet, pagesize=A2)
-        # can.rotate(90)
-
-        self.draw(can, 'Рабочий проект дизайн интерьера',  600, 390, 24)
-        self.draw(can, residence.title, 600, 325, 38)
-        self.draw(can, room_count + ": " + f"{residence.slug}/{cluster.name}/{layout.room_number}.{layout.variant}/{layout.type_of_apartment}" , 600, 275, 28)
-        self.draw(can, self.user.full_name, 975, 85, 24)
-        
-        can.save()
-
-        packet.seek(0)
+    def doc_name(self):
+        """Имя договора по хэшу входных данных (ЖК, кластер, планировка, ФИО, версия шаблона)"""
+        renderer = get_renderer()
+        return renderer.document_name(renderer.order_lines(self))
 
-        new_pdf = PdfFileReader(packet)
-        existing_pdf = PdfFileReader(open("./utils/projetto_titul.pdf", "rb"))
-        output = PdfFileWriter()
+    def has_current_doc(self):
+        return bool(self.doc) and self.doc.name == self.doc_name() and self.doc.storage.exists(self.doc.name)
 
-        page = existing_pdf.pages[0]
-        page.merge_page(new_pdf.pages[0])
-        output.add_page(page)
-
-        file_name = residence.title + ".pdf"
-        file_path = os.path.join('docs', file_name)
+    def generate_doc(self):
+        renderer = get_renderer()
+        lines = renderer.order_lines(self)
+        file_path = renderer.document_name(lines)
 
-        with default_storage.open(file_path, "wb") as file:
-            output.write(file)
+        # Документ с такими же данными уже сгенерирован - отдаём его без повторного рендера
+        storage = self.doc.storage
+        if not storage.exists(file_path):
+            buffer = io.BytesIO()
+            renderer.render(lines, buffer)
+            file_path = save_named(storage, file_path, ContentFile(buffer.getvalue()))
 
-        self.doc.name = file_path
-        self.save()
+        if self.doc.name != file_path:
+            self.doc.name = file_path
+            self.save(update_fields=['doc'])
 
-        return self.doc.url
+        # Не ссылка на файл, а точка скачивания с проверкой прав
+        return reverse('order-doc', args=[self.pk])
 
     def __str__(self):
         return f"Заказ #{self.pk}"
@@ -122,6 +84,7 @@ class Order(models.Model):
     class Meta:
         verbose_name = "Заказ"
         verbose_name_plural = "Заказы"
+        indexes = [models.Index(fields=['created_at', 'id'])]
 
 
 class Ticket(Timestamp):
@@ -135,16 +98,44 @@ class Ticket(Timestamp):
         verbose_name_plural = 'Тикеты'
         ordering = ['created_at']
 
-class TicketAttachment(Timestamp):
+class TicketAttachment(BlobReferencesMixin, Timestamp):
     ticket = models.ForeignKey("Ticket", on_delete=models.CASCADE, blank=True)
     name = models.CharField(max_length=100, blank=True)
-    file = models.FileField("Screenshot", upload_to='tickets/', blank=True)
+    file = models.FileField("Screenshot", upload_to='tickets/', storage=content_addressed_storage, blank=True)
 
     class Meta:
         verbose_name = 'Вложение для Тикета'
         verbose_name_plural = 'Вложении  для Тикета'
 
 
+class UploadSession(Timestamp):
+    TARGET_CHOICES = (
+        ('layout_pdf', 'PDF планировки'),
+        ('ticket_attachment', 'Вложение тикета'),
+    )
+    STATUS_CHOICES = (
+        ('active', 'Загружается'),
+        ('complete', 'Завершена'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, verbose_name="Пользователь", on_delete=models.SET_NULL, null=True, blank=True)
+    target = models.CharField("Куда прикрепить", max_length=30, choices=TARGET_CHOICES)
+    object_id = models.PositiveIntegerField("ID объекта")
+    filename = models.CharField("Имя файла", max_length=255)
+    size = models.PositiveBigIntegerField("Размер")
+    offset = models.PositiveBigIntegerField("Получено байт", default=0)
+    parts = models.JSONField("Части", default=list, blank=True)
+    status = models.CharField("Статус", max_length=20, choices=STATUS_CHOICES, default='active')
+
+    class Meta:
+        verbose_name = 'Загрузка файла'
+        verbose_name_plural = 'Загрузки файлов'
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+
 class SMSMessage(Timestamp):
     STATUS_SMS = (
         ('sent', 'Отправлено'),
@@ -0,0 +1,112 @@
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files import File
+from django.urls import reverse
+
+from .documents import save_named
+
+FREE_PROJECT_PATH = settings.BASE_DIR / 'utils' / 'project_free.pdf'
+PACKAGES_PREFIX = 'packages/'
+
+# Сколько страниц переносится за один проход; после каждого прохода документы закрываются,
+# поэтому память воркера зависит от размера пачки, а не от числа страниц в планировке
+PACKAGE_BATCH_PAGES = 50
+
+
+@lru_cache(maxsize=None)
+def free_project_version():
+    digest = hashlib.sha256()
+    with open(FREE_PROJECT_PATH, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def package_name(order, include_free):
+    """Имя пакета по хэшу составляющих: титульный лист и PDF планировки уже названы по содержимому"""
+    parts = [order.doc.name, order.flat_layout.pdf.name, free_project_version() if include_free else '']
+    digest = hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+    return f'{PACKAGES_PREFIX}{digest[:2]}/{digest}.pdf'
+
+
+@contextmanager
+def local_path(field_file):
+    """Путь к файлу на диске; для хранилищ без path() файл потоково копируется во временный"""
+    try:
+        path = field_file.storage.path(field_file.name)
+    except NotImplementedError:
+        path = None
+
+    if path is not None:
+        yield path
+        return
+
+    with tempfile.NamedTemporaryFile(suffix='.pdf') as tmp:
+        with field_file.open('rb'):
+            for chunk in field_file.chunks():
+                tmp.write(chunk)
+        tmp.flush()
+        yield tmp.name
+
+
+def assemble_pdf(sources, output_path, batch_pages=PACKAGE_BATCH_PAGES):
+    """
+    Склеивает PDF из sources (пути на диске) в output_path.
+    Страницы добавляются пачками с инкрементальным сохранением (дописываются в конец файла),
+    после каждой пачки выходной и исходный документы закрываются и открываются заново,
+    поэтому в памяти не держится весь документ. Общие шрифты и картинки исходника
+    копируются заново в каждую пачку - это плата за ограниченную память.
+    """
+    import fitz
+
+    created = False
+    for source_path in sources:
+        with fitz.open(source_path) as source:
+            page_count = source.page_count
+        for start in range(0, page_count, batch_pages):
+            end = min(start + batch_pages, page_count) - 1
+            with fitz.open(source_path) as source, (fitz.open(output_path) if created else fitz.open()) as output:
+                output.insert_pdf(source, from_page=start, to_page=end)
+                if created:
+                    output.saveIncr()
+                else:
+                    output.save(output_path)
+                    created = True
+
+
+def build_package(order, include_free=False):
+    """
+    Полный пакет проекта: титульный лист договора + PDF купленной планировки (+ project_free.pdf).
+    Готовый пакет с теми же составляющими не пересобирается. Возвращает путь /orders/{id}/package/.
+    """
+    layout = order.flat_layout
+    if not layout.pdf:
+        raise ValueError(f'Layout {layout.pk} has no PDF')
+
+    order.generate_doc()
+    name = package_name(order, include_free)
+
+    storage = order.package.storage
+    if not storage.exists(name):
+        with tempfile.TemporaryDirectory() as directory, \
+                local_path(order.doc) as doc_path, local_path(layout.pdf) as layout_path:
+            sources = [doc_path, layout_path]
+            if include_free:
+                sources.append(str(FREE_PROJECT_PATH))
+
+            output_path = os.path.join(directory, 'package.pdf')
+            assemble_pdf(sources, output_path)
+            # Хранилище копирует файл кусками, целиком в память он не читается
+            with open(output_path, 'rb') as file:
+                name = save_named(storage, name, File(file))
+
+    if order.package.name != name:
+        order.package.name = name
+        order.save(update_fields=['package'])
+
+    return reverse('order-package', args=[order.pk])
@@ -10,3 +10,12 @@ class IsAuthenticatedOrAdminOrReadOnly(BasePermission):
         if request.method in SAFE_METHODS:
             return True
         return request.user.is_authenticated and request.user.is_staff
+
+
+class IsOwnerOrStaff(BasePermission):
+    """
+    Доступ к объекту только его владельцу (obj.user) или сотруднику.
+    """
+
+    def has_object_permission(self, request, view, obj):
+        return request.user.is_staff or obj.user_id == request.user.id
@@ -1,8 +1,22 @@
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from service.models import Order
 
 class OrderSerializer(serializers.ModelSerializer):
+    # Не публичные ссылки на файлы, а защищённые точки скачивания
+    doc = serializers.SerializerMethodField()
+    package = serializers.SerializerMethodField()
     class Meta:
         model = Order
         fields = "__all__"
-        read_only_fields = ('created_at', 'updated_at', 'doc')
+        read_only_fields = ('created_at', 'updated_at')
+
+    def get_doc(self, obj):
+        if not obj.doc:
+            return None
+        return reverse('order-doc', args=[obj.pk], request=self.context.get('request'))
+
+    def get_package(self, obj):
+        if not obj.package:
+            return None
+        return reverse('order-package', args=[obj.pk], request=self.context.get('request'))
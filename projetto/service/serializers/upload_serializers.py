@@ -0,0 +1,34 @@
+import posixpath
+
+from rest_framework import serializers
+from rest_framework.exceptions import PermissionDenied
+
+from service.models import UploadSession
+from service.uploads import UPLOAD_MAX_SIZE, get_target_object
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'target', 'object_id', 'filename', 'size', 'offset', 'status', 'created_at')
+        read_only_fields = ('id', 'offset', 'status', 'created_at')
+
+    def validate_filename(self, value):
+        filename = posixpath.basename(value.replace('\\', '/'))
+        if not filename:
+            raise serializers.ValidationError("Пустое имя файла")
+        return filename
+
+    def validate_size(self, value):
+        if not 0 < value <= UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f"Размер должен быть от 1 до {UPLOAD_MAX_SIZE} байт")
+        return value
+
+    def validate(self, attrs):
+        request = self.context['request']
+        # PDF планировок загружают только сотрудники, вложения тикетов - все, как и в TicketAttachmentViewSet
+        if attrs['target'] == 'layout_pdf' and not request.user.is_staff:
+            raise PermissionDenied()
+        if get_target_object(attrs['target'], attrs['object_id']) is None:
+            raise serializers.ValidationError({'object_id': "Объект не найден"})
+        return attrs
@@ -1,9 +1,120 @@
-from celery import shared_task
+import uuid
+
+from celery import shared_task, group
+from celery.result import GroupResult
+from celery.signals import task_postrun
+from django.core.cache import cache
 from .models import Order
+from .packages import build_package
+from .events import publish_task_result
 from app.celery import app as celery_app
 
+# Сколько заказов обрабатывает одна задача пакетной генерации
+DOCS_CHUNK_SIZE = 50
+DOCS_BATCH_KEY = 'docs:batch:{}'
+DOCS_BATCH_TIMEOUT = 24 * 60 * 60
+
+# id задачи start_task, которая стоит в очереди или выполняется для заказа; по таймауту ключ
+# освобождается сам, если воркер упал и не снял его
+ORDER_DOC_TASK_KEY = 'orders:doc-task:{}'
+ORDER_DOC_TASK_TIMEOUT = 10 * 60
+
 @celery_app.task
 def start_task(order_id):
     order = Order.objects.get(id=order_id)
     result = order.generate_doc()
     return result
+
+
+@celery_app.task
+def build_package_task(order_id, include_free=False):
+    order = Order.objects.select_related('user', 'apartment', 'flat_layout', 'cluster__residence_id').get(id=order_id)
+    return build_package(order, include_free)
+
+
+def enqueue_doc_task(order_id):
+    """
+    Ставит start_task для заказа, если для него ещё нет задачи в очереди или в работе.
+    Возвращает id новой задачи или уже запущенной (повторные нажатия и ретраи клиента).
+    """
+    key = ORDER_DOC_TASK_KEY.format(order_id)
+    task_id = str(uuid.uuid4())
+    # cache.add атомарен (в Redis - SET NX): задачу ставит только первый запрос
+    if not cache.add(key, task_id, ORDER_DOC_TASK_TIMEOUT):
+        existing = cache.get(key)
+        if existing is not None:
+            return existing
+        # Ключ истёк между add и get - просто ставим задачу заново
+        cache.set(key, task_id, ORDER_DOC_TASK_TIMEOUT)
+
+    try:
+        start_task.apply_async((order_id,), task_id=task_id)
+    except Exception:
+        cache.delete(key)
+        raise
+    return task_id
+
+
+@task_postrun.connect
+def release_doc_task(sender=None, task_id=None, args=None, **kwargs):
+    """Снимает отметку о задаче заказа, если она ещё принадлежит этой задаче"""
+    if sender == start_task and args:
+        key = ORDER_DOC_TASK_KEY.format(args[0])
+        if cache.get(key) == task_id:
+            cache.delete(key)
+
+
+@task_postrun.connect
+def publish_document_ready(sender=None, task_id=None, retval=None, state=None, **kwargs):
+    """Оповещает /tasks/{id}/events/ о завершении генерации договора или пакета"""
+    if sender in (start_task, build_package_task):
+        publish_task_result(task_id, state, retval)
+
+
+@celery_app.task(bind=True)
+def generate_docs_chunk(self, order_ids):
+    """
+    Генерирует договоры для части заказов. Шаблон и шрифт загружаются воркером один раз
+    (service.documents.get_renderer) и используются для всех заказов пачки.
+    """
+    orders = Order.objects.filter(id__in=order_ids).select_related(
+        'user', 'apartment', 'flat_layout', 'cluster__residence_id')
+    done, failed = 0, []
+    for order in orders:
+        try:
+            order.generate_doc()
+            done += 1
+        except Exception:
+            failed.append(order.id)
+        self.update_state(state='PROGRESS', meta={'done': done, 'failed': failed})
+    return {'done': done, 'failed': failed}
+
+
+def start_docs_batch(order_ids, chunk_size=DOCS_CHUNK_SIZE):
+    """Раскладывает заказы на пачки и запускает их группой; возвращает id группы для docs_batch_progress или None, если заказов нет"""
+    order_ids = list(order_ids)
+    if not order_ids:
+        return None
+    chunks = [order_ids[i:i + chunk_size] for i in range(0, len(order_ids), chunk_size)]
+    result = group(generate_docs_chunk.s(chunk) for chunk in chunks).apply_async()
+    result.save()
+    cache.set(DOCS_BATCH_KEY.format(result.id), len(order_ids), DOCS_BATCH_TIMEOUT)
+    return result.id
+
+
+def docs_batch_progress(batch_id):
+    """Суммарный прогресс пакетной генерации по всем пачкам группы, None если группа не найдена"""
+    result = GroupResult.restore(batch_id, app=celery_app)
+    if result is None:
+        return None
+
+    progress = {'total': cache.get(DOCS_BATCH_KEY.format(batch_id)), 'done': 0, 'failed': [],
+                'chunks': len(result.results), 'chunks_ready': 0}
+    for chunk in result.results:
+        if chunk.state in ('SUCCESS', 'FAILURE'):
+            progress['chunks_ready'] += 1
+        info = chunk.info if isinstance(chunk.info, dict) else {}
+        progress['done'] += info.get('done', 0)
+        progress['failed'].extend(info.get('failed', []))
+    progress['ready'] = progress['chunks_ready'] == progress['chunks']
+    return progress
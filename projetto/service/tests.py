@@ -1,3 +1,362 @@
-from django.test import TestCase
+import io
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from PyPDF2 import PdfFileReader
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from app.sendfile import protected_storage
+from app.testing import TemporaryMediaMixin, create_layout, create_order, pdf_file
+
+from . import packages, tasks
+from .documents import get_renderer, room_count_title
+from .models import User, Order, UploadSession
+from .serializers.order_serializers import OrderSerializer
+from .views import event_views
+
+
+class OrderTestMixin(TemporaryMediaMixin):
+    """Заказ self.order пользователя self.user с данными для титульного листа"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='user', password='password', full_name='Иван Иванов')
+        self.order = create_order(self.user)
+
+
+class OrderListTests(TemporaryMediaMixin, TestCase):
+    def test_cursor_pagination_walks_orders_newest_first(self):
+        user = User.objects.create_user(username='user', password='password')
+        orders = [create_order(user) for _ in range(12)]
+        self.client.force_login(user)
+
+        first = self.client.get('/orders/?pagination=cursor', secure=True).json()
+        second = self.client.get(first['next'], secure=True).json()
+        self.assertEqual([order['id'] for order in first['results'] + second['results']],
+                         [order.pk for order in reversed(orders)])
+        self.assertIsNone(second['next'])
+
+
+class OrderDocumentTests(OrderTestMixin, TestCase):
+    def test_generate_doc_returns_protected_endpoint(self):
+        self.assertEqual(self.order.generate_doc(), f'/orders/{self.order.pk}/doc/')
+        self.assertTrue(self.order.has_current_doc())
+        self.assertTrue(protected_storage.exists(self.order.doc.name))
+        self.assertEqual(self.client.get(f'/media/{self.order.doc.name}').status_code, 404)
+
+    def test_serializer_does_not_expose_file_url(self):
+        self.order.generate_doc()
+        data = OrderSerializer(self.order).data
+        self.assertEqual(data['doc'], f'/orders/{self.order.pk}/doc/')
+        self.assertIsNone(data['package'])
+
+    def test_doc_is_served_to_owner_only(self):
+        self.order.generate_doc()
+        self.assertIn(self.client.get(f'/orders/{self.order.pk}/doc/', secure=True).status_code, (401, 403))
+
+        self.client.force_login(User.objects.create_user(username='other', password='password'))
+        self.assertIn(self.client.get(f'/orders/{self.order.pk}/doc/', secure=True).status_code, (403, 404))
+
+        self.client.force_login(self.user)
+        response = self.client.get(f'/orders/{self.order.pk}/doc/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_signed_doc_url(self):
+        self.order.generate_doc()
+        self.client.force_login(self.user)
+        url = self.client.get(f'/orders/{self.order.pk}/doc_url/', secure=True).json()['url']
+        self.client.logout()
+        response = self.client.get(url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'order-{self.order.pk}.pdf', response['Content-Disposition'])
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_missing_file_returns_404(self):
+        self.order.generate_doc()
+        protected_storage.delete(self.order.doc.name)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(f'/orders/{self.order.pk}/doc/', secure=True).status_code, 404)
+
+    @override_settings(SENDFILE_BACKEND='nginx')
+    def test_nginx_backend_hands_off_to_internal_location(self):
+        self.order.generate_doc()
+        self.client.force_login(self.user)
+        response = self.client.get(f'/orders/{self.order.pk}/doc/', secure=True)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{self.order.doc.name}')
+        self.assertEqual(response.content, b'')
+        self.assertIn(f'order-{self.order.pk}.pdf', response['Content-Disposition'])
+
+    def test_concurrently_saved_doc_keeps_hash_name(self):
+        name = self.order.doc_name()
+        directory, filename = name.rsplit('/', 1)
+        protected_storage.save(name, ContentFile(b'%PDF other worker'))
+
+        # Первая проверка exists() прошла до того, как другой воркер записал тот же договор
+        exists = protected_storage.exists
+        checks = iter([False])
+        with mock.patch.object(protected_storage, 'exists', lambda path: next(checks, None) is not False and exists(path)):
+            self.order.generate_doc()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.doc.name, name)
+        self.assertEqual(protected_storage.listdir(directory)[1], [filename])
+
+    def test_move_order_files(self):
+        name = default_storage.save('docs/legacy.pdf', ContentFile(b'%PDF legacy'))
+        self.order.doc.name = name
+        self.order.save(update_fields=['doc'])
+
+        call_command('move_order_files', stdout=mock.Mock())
+        self.assertFalse(default_storage.exists(name))
+        with protected_storage.open(name) as file:
+            self.assertEqual(file.read(), b'%PDF legacy')
+
+
+class UploadSessionTests(TemporaryMediaMixin, TestCase):
+    content = b'%PDF-1.4 ' + b'x' * 100
+
+    def setUp(self):
+        super().setUp()
+        self.layout = create_layout()
+        self.staff = User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.force_login(self.staff)
+        response = self.client.post('/uploads/', {'target': 'layout_pdf', 'object_id': self.layout.pk,
+                                                  'filename': 'plan.pdf', 'size': len(self.content)},
+                                    content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 201)
+        self.session_url = f"/uploads/{response.json()['id']}/"
+
+    def put_chunk(self, offset, chunk):
+        return self.client.put(f'{self.session_url}?offset={offset}', chunk,
+                               content_type='application/octet-stream', secure=True)
+
+    def complete(self):
+        return self.client.post(f'{self.session_url}complete/', secure=True)
+
+    def test_upload_is_attached_to_layout(self):
+        self.assertEqual(self.put_chunk(0, self.content[:60]).json()['offset'], 60)
+        self.assertEqual(self.put_chunk(60, self.content[60:]).json()['offset'], len(self.content))
+
+        response = self.complete()
+        self.assertEqual(response.status_code, 200)
+        self.layout.refresh_from_db()
+        self.assertEqual(response.json(), {'layout': self.layout.pk, 'file': self.layout.pdf.name})
+        self.assertTrue(self.layout.pdf.name.startswith('paid/'))
+        with self.layout.pdf.open('rb') as file:
+            self.assertEqual(file.read(), self.content)
+        self.assertFalse(any(protected_storage.exists(name) for name in UploadSession.objects.get().parts))
+        self.assertEqual(self.complete().status_code, 400)
+
+    def test_wrong_offset_returns_current_offset(self):
+        self.put_chunk(0, self.content[:60])
+        response = self.put_chunk(10, self.content[10:20])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json(), {'offset': 60})
+
+    def test_incomplete_upload_cannot_be_completed(self):
+        self.put_chunk(0, self.content[:60])
+        self.assertEqual(self.complete().status_code, 400)
+        self.layout.refresh_from_db()
+        self.assertFalse(self.layout.pdf)
+
+    def test_other_user_cannot_continue_upload(self):
+        self.put_chunk(0, self.content[:60])
+        self.client.force_login(User.objects.create_user(username='other', password='password', is_staff=True))
+        self.assertIn(self.put_chunk(60, self.content[60:]).status_code, (403, 404))
+        self.assertIn(self.complete().status_code, (403, 404))
+        self.assertEqual(UploadSession.objects.get().offset, 60)
+
+    def test_layout_pdf_upload_requires_staff(self):
+        self.client.force_login(User.objects.create_user(username='user', password='password'))
+        response = self.client.post('/uploads/', {'target': 'layout_pdf', 'object_id': self.layout.pk,
+                                                  'filename': 'plan.pdf', 'size': 10},
+                                    content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 403)
+
+
+class DocumentRendererTests(OrderTestMixin, TestCase):
+    def render(self, order):
+        output = io.BytesIO()
+        renderer = get_renderer()
+        renderer.render(renderer.order_lines(order), output)
+        return output.getvalue()
+
+    def test_template_is_loaded_once_and_left_intact(self):
+        renderer = get_renderer()
+        self.assertIs(get_renderer(), renderer)
+        template = renderer.template_page.get_contents().get_data()
+
+        other = create_order(User.objects.create_user(username='other', password='password', full_name='Пётр Петров'))
+        first, second = self.render(self.order), self.render(other)
+        self.assertNotEqual(first, second)
+        self.assertEqual(len(PdfFileReader(io.BytesIO(first)).pages), 1)
+        self.assertEqual(renderer.template_page.get_contents().get_data(), template)
+
+    def test_room_count_title(self):
+        self.assertEqual(room_count_title(2), 'Двухкомнатная квартира')
+        self.assertEqual(room_count_title(5), '5-комнатная квартира')
+
+    def test_benchmark_docs(self):
+        stdout = io.StringIO()
+        call_command('benchmark_docs', count=2, stdout=stdout)
+        self.assertTrue(stdout.getvalue())
+
+
+class DocsBatchTests(OrderTestMixin, TestCase):
+    def test_orders_are_split_into_chunks(self):
+        with mock.patch.object(tasks, 'group') as group:
+            group.return_value.apply_async.return_value.id = 'batch'
+            self.assertEqual(tasks.start_docs_batch([1, 2, 3, 4, 5], chunk_size=2), 'batch')
+        chunks = [signature.args[0] for signature in group.call_args.args[0]]
+        self.assertEqual(chunks, [[1, 2], [3, 4], [5]])
+        self.assertEqual(cache.get(tasks.DOCS_BATCH_KEY.format('batch')), 5)
+        self.assertIsNone(tasks.start_docs_batch([]))
+
+    def test_chunk_reports_done_and_failed_orders(self):
+        broken = create_order(self.user)
+        generate_doc = Order.generate_doc
+
+        def fail_for_broken(order):
+            if order.pk == broken.pk:
+                raise OSError
+            return generate_doc(order)
+
+        with mock.patch.object(Order, 'generate_doc', fail_for_broken), \
+                mock.patch.object(tasks.generate_docs_chunk, 'update_state') as update_state:
+            result = tasks.generate_docs_chunk([self.order.pk, broken.pk])
+        self.assertEqual(result, {'done': 1, 'failed': [broken.pk]})
+        self.assertEqual(update_state.call_count, 2)
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.has_current_doc())
+
+    def test_progress_endpoint_sums_chunks(self):
+        cache.set(tasks.DOCS_BATCH_KEY.format('batch'), 60)
+        chunks = [SimpleNamespace(state='SUCCESS', info={'done': 50, 'failed': []}),
+                  SimpleNamespace(state='PROGRESS', info={'done': 4, 'failed': [7]})]
+        self.client.force_login(User.objects.create_user(username='staff', password='password', is_staff=True))
+
+        with mock.patch.object(tasks.GroupResult, 'restore', return_value=SimpleNamespace(results=chunks)):
+            response = self.client.get('/orders/docs_batch/?batch_id=batch', secure=True)
+        self.assertEqual(response.json(), {'total': 60, 'done': 54, 'failed': [7], 'chunks': 2,
+                                           'chunks_ready': 1, 'ready': False})
+
+        with mock.patch.object(tasks.GroupResult, 'restore', return_value=None):
+            self.assertEqual(self.client.get('/orders/docs_batch/?batch_id=other', secure=True).status_code, 404)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/orders/docs_batch/?batch_id=batch', secure=True).status_code, 403)
+
+
+class PackageTests(OrderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.order.flat_layout.pdf.save('plan.pdf', pdf_file(pages=3))
+
+    def page_count(self, field_file):
+        with field_file.open('rb') as file:
+            return len(PdfFileReader(io.BytesIO(file.read())).pages)
+
+    def test_package_contains_doc_and_layout_pages(self):
+        self.assertEqual(packages.build_package(self.order), f'/orders/{self.order.pk}/package/')
+        self.order.refresh_from_db()
+        self.assertTrue(protected_storage.exists(self.order.package.name))
+        self.assertEqual(self.page_count(self.order.package), 1 + 3)
+
+        self.client.force_login(self.user)
+        response = self.client.get(f'/orders/{self.order.pk}/package/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'project-{self.order.pk}.pdf', response['Content-Disposition'])
+
+    def test_free_project_is_appended(self):
+        with open(packages.FREE_PROJECT_PATH, 'rb') as file:
+            free_pages = len(PdfFileReader(file).pages)
+        packages.build_package(self.order, include_free=True)
+        self.order.refresh_from_db()
+        self.assertEqual(self.page_count(self.order.package), 1 + 3 + free_pages)
+
+    def test_pages_are_copied_in_batches(self):
+        output = f'{self.media_root}/package.pdf'
+        with packages.local_path(self.order.flat_layout.pdf) as layout_path:
+            packages.assemble_pdf([layout_path, layout_path], output, batch_pages=2)
+        with open(output, 'rb') as file:
+            self.assertEqual(len(PdfFileReader(file).pages), 6)
+
+    def test_existing_package_is_not_rebuilt(self):
+        packages.build_package(self.order)
+        with mock.patch.object(packages, 'assemble_pdf') as assemble_pdf:
+            packages.build_package(self.order)
+        assemble_pdf.assert_not_called()
+
+
+def fake_task_events(*events):
+    """Подменяет service.events.task_events: отдаёт events без Redis"""
+    async def task_events(task_id, timeout, heartbeat):
+        for event in events:
+            yield event
+    return task_events
+
+
+class TaskEventsTests(TestCase):
+    done = {'state': 'SUCCESS', 'result': '/orders/1/doc/'}
+
+    async def test_sse_sends_ping_and_done_event(self):
+        with mock.patch.object(event_views, 'task_events', fake_task_events(None, self.done)):
+            response = await self.async_client.get('/tasks/task/events/', headers={'Accept': 'text/event-stream'},
+                                                   secure=True)
+            body = ''.join([chunk.decode() async for chunk in response.streaming_content])
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['X-Accel-Buffering'], 'no')
+        self.assertEqual(body, ': ping\n\nevent: done\ndata: {"message": "pdf is ready", '
+                               '"url": "https://testserver/orders/1/doc/"}\n\n')
+
+    async def test_long_poll_returns_ready_document(self):
+        with mock.patch.object(event_views, 'task_events', fake_task_events(None, self.done)):
+            response = await self.async_client.get('/tasks/task/events/', secure=True)
+        self.assertEqual(response.json(), {'message': "pdf is ready", 'url': 'https://testserver/orders/1/doc/'})
+
+    async def test_long_poll_times_out(self):
+        with mock.patch.object(event_views, 'task_events', fake_task_events(None)):
+            response = await self.async_client.get('/tasks/task/events/?timeout=1', secure=True)
+        self.assertEqual(response.json(), {'message': "pdf is generating"})
+        self.assertEqual((await self.async_client.get('/tasks/task/events/?timeout=x', secure=True)).status_code, 400)
+
+    def test_finished_document_task_is_published(self):
+        with mock.patch.object(tasks, 'publish_task_result') as publish_task_result:
+            tasks.publish_document_ready(sender=tasks.start_task, task_id='task', retval='/orders/1/doc/', state='SUCCESS')
+            tasks.publish_document_ready(sender=tasks.generate_docs_chunk, task_id='chunk', retval={}, state='SUCCESS')
+        publish_task_result.assert_called_once_with('task', 'SUCCESS', '/orders/1/doc/')
+
+
+class DocTaskDedupTests(OrderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(tasks.start_task, 'apply_async')
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_repeated_requests_reuse_queued_task(self):
+        task_ids = {self.client.get(f'/orders/{self.order.pk}/generate_pdf/', secure=True).json()['task_id']
+                    for _ in range(3)}
+        self.assertEqual(len(task_ids), 1)
+        self.assertEqual(self.apply_async.call_count, 1)
+
+    def test_finished_task_releases_order(self):
+        task_id = tasks.enqueue_doc_task(self.order.pk)
+        # Чужая задача не снимает отметку
+        tasks.release_doc_task(sender=tasks.start_task, task_id='other', args=(self.order.pk,))
+        self.assertEqual(tasks.enqueue_doc_task(self.order.pk), task_id)
+
+        tasks.release_doc_task(sender=tasks.start_task, task_id=task_id, args=(self.order.pk,))
+        self.assertNotEqual(tasks.enqueue_doc_task(self.order.pk), task_id)
+        self.assertEqual(self.apply_async.call_count, 2)
+
+    def test_failed_enqueue_releases_order(self):
+        self.apply_async.side_effect = OSError
+        with self.assertRaises(OSError):
+            tasks.enqueue_doc_task(self.order.pk)
+        self.assertIsNone(cache.get(tasks.ORDER_DOC_TASK_KEY.format(self.order.pk)))
@@ -0,0 +1,86 @@
+import posixpath
+
+from django.core.files import File
+from django.db import transaction
+
+from app.sendfile import protected_storage
+from residence.models import Layout
+from .models import Ticket, TicketAttachment
+
+# Максимальный размер одного куска: тело PUT пишется в хранилище потоком, но ограничиваем время запроса
+UPLOAD_CHUNK_MAX_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_SIZE = 200 * 1024 * 1024
+
+
+class UploadPartsReader:
+    """Файлоподобный объект, который последовательно читает части загрузки из хранилища"""
+
+    def __init__(self, names, size, storage=protected_storage):
+        self.names = names
+        self.size = size
+        self.storage = storage
+        self._index = 0
+        self._current = None
+
+    def seek(self, position, whence=0):
+        if position != 0 or whence != 0:
+            raise ValueError('UploadPartsReader supports only rewinding to the start')
+        self.close()
+        self._index = 0
+
+    def read(self, size=-1):
+        data = []
+        while size < 0 or size > 0:
+            if self._current is None:
+                if self._index >= len(self.names):
+                    break
+                self._current = self.storage.open(self.names[self._index], 'rb')
+                self._index += 1
+            chunk = self._current.read(size)
+            if not chunk:
+                self._current.close()
+                self._current = None
+                continue
+            data.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(data)
+
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+
+
+# Части лежат в защищённом хранилище: среди загрузок бывают платные PDF планировок
+def part_name(session, offset):
+    return posixpath.join('uploads', str(session.pk), f'{offset:012d}.part')
+
+
+def delete_parts(session):
+    for name in session.parts:
+        protected_storage.delete(name)
+
+
+def get_target_object(target, object_id):
+    model = {'layout_pdf': Layout, 'ticket_attachment': Ticket}[target]
+    return model.objects.filter(pk=object_id).first()
+
+
+def attach_upload(session):
+    """Собирает части в итоговый файл и прикрепляет его к объекту; возвращает описание результата"""
+    reader = UploadPartsReader(session.parts, session.size)
+    content = File(reader, name=session.filename)
+    # Файл по хэшу и ссылка на него сохраняются одной транзакцией (BlobReferencesMixin)
+    try:
+        with transaction.atomic():
+            if session.target == 'layout_pdf':
+                layout = Layout.objects.get(pk=session.object_id)
+                layout.pdf.save(session.filename, content, save=True)
+                return {'layout': layout.pk, 'file': layout.pdf.name}
+
+            attachment = TicketAttachment(ticket_id=session.object_id, name=session.filename)
+            attachment.file.save(session.filename, content, save=True)
+            return {'ticket_attachment': attachment.pk, 'file': attachment.file.name}
+    finally:
+        reader.close()
@@ -0,0 +1,58 @@
+import json
+from contextlib import aclosing
+
+from django.http import JsonResponse, StreamingHttpResponse
+
+from service.events import task_events
+
+# Long-poll: сколько держать запрос без результата; SSE: сколько держать поток и как часто слать ping
+LONG_POLL_TIMEOUT = 25
+LONG_POLL_MAX_TIMEOUT = 60
+SSE_TIMEOUT = 5 * 60
+SSE_HEARTBEAT = 15
+
+
+def task_status_message(request, event):
+    """Тот же ответ, что у /orders/{id}/check_pdf_status/"""
+    if event['state'] == 'SUCCESS':
+        return {'message': "pdf is ready", 'url': request.build_absolute_uri(event['result'])}
+    return {'message': "pdf generating is failed"}
+
+
+async def sse_stream(request, task_id):
+    async with aclosing(task_events(task_id, SSE_TIMEOUT, SSE_HEARTBEAT)) as events:
+        async for event in events:
+            if event is None:
+                # Комментарий SSE не даёт прокси закрыть простаивающее соединение
+                yield ': ping\n\n'
+                continue
+            data = json.dumps(task_status_message(request, event), ensure_ascii=False)
+            yield f'event: done\ndata: {data}\n\n'
+            return
+    # Поток закрывается по таймауту, EventSource переподключится сам
+    yield 'retry: 1000\n\n'
+
+
+async def task_status_events(request, task_id):
+    """
+    Ожидание готовности документа вместо опроса check_pdf_status (асинхронный view, нужен запуск через app.asgi).
+    Accept: text/event-stream - поток SSE с событием done; иначе long-poll: ответ приходит сразу
+    после завершения задачи или {"message": "pdf is generating"} через ?timeout= секунд (по умолчанию 25, не больше 60).
+    """
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        response = StreamingHttpResponse(sse_stream(request, task_id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # nginx не должен буферизовать поток
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    try:
+        timeout = min(max(int(request.GET.get('timeout', LONG_POLL_TIMEOUT)), 1), LONG_POLL_MAX_TIMEOUT)
+    except ValueError:
+        return JsonResponse({'detail': 'timeout must be a number'}, status=400)
+
+    async with aclosing(task_events(task_id, timeout, timeout)) as events:
+        async for event in events:
+            if event is not None:
+                return JsonResponse(task_status_message(request, event))
+    return JsonResponse({'message': "pdf is generating"})
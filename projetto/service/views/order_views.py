@@ -1,19 +1,27 @@
 from celery.result import AsyncResult
 
+from django.urls import reverse
+
 from rest_framework import viewsets
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticatedOrReadOnly, AllowAny, IsAuthenticated, IsAdminUser
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+
+from app.sendfile import sendfile
+from app.signing import sign_file_url
 
 
-from service.tasks import start_task
+from service.tasks import enqueue_doc_task, build_package_task, docs_batch_progress
 from ..models import Order
 from ..serializers.order_serializers import OrderSerializer
+from ..permissions import IsOwnerOrStaff
 
 class OrderViewSet(viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     http_method_names = ['get', 'post', 'put', 'patch']
+    cursor_ordering = '-id'
 
     @action(detail=True, methods=['get'], permission_classes = [AllowAny])
     def generate_pdf(self, request, pk=None):
@@ -28,16 +36,70 @@ class OrderViewSet(viewsets.ModelViewSet):
 
         order = self.queryset.get(pk=pk)
 
-        result = start_task.delay(order.id)
+        if order.has_current_doc():
+            return Response({'message': "pdf is ready", 'url': request.build_absolute_uri(reverse('order-doc', args=[order.pk]))})
 
-        url = request.build_absolute_uri(f'/orders/{order.id}/check_pdf_status/?task_id={result.id}')
+        # Повторный запрос, пока задача заказа в очереди или в работе, получает её же id
+        task_id = enqueue_doc_task(order.id)
+
+        url = request.build_absolute_uri(f'/orders/{order.id}/check_pdf_status/?task_id={task_id}')
         
         return Response({
             'message': "pdf is generating",
-            'task_id': result.id,
-            'check_pdf_status': url
+            'task_id': task_id,
+            'check_pdf_status': url,
+            'events': request.build_absolute_uri(reverse('task-events', kwargs={'task_id': task_id})),
             })
     
+    @action(detail=True, methods=['get'], permission_classes = [IsAuthenticated, IsOwnerOrStaff])
+    def doc(self, request, pk=None):
+        """Скачивание договора (только владельцу заказа и сотрудникам)"""
+        order = self.get_object()
+        if not order.doc:
+            raise NotFound('Order has no document yet.')
+        return sendfile(request, order.doc, filename=f'order-{order.pk}.pdf')
+
+    @action(detail=True, methods=['get'], permission_classes = [IsAuthenticated, IsOwnerOrStaff])
+    def doc_url(self, request, pk=None):
+        """Короткоживущая подписанная ссылка на договор"""
+        order = self.get_object()
+        if not order.doc:
+            raise NotFound('Order has no document yet.')
+        url, expires = sign_file_url(request, order.doc, filename=f'order-{order.pk}.pdf')
+        return Response({'url': url, 'expires': expires})
+
+    @action(detail=True, methods=['post'], permission_classes = [IsAuthenticated, IsOwnerOrStaff])
+    def generate_package(self, request, pk=None):
+        """Сборка пакета проекта: титульный лист + PDF планировки (?free=1 - с project_free.pdf)"""
+        order = self.get_object()
+        if not order.flat_layout.pdf:
+            raise NotFound('Layout has no PDF.')
+
+        result = build_package_task.delay(order.id, request.query_params.get('free') == '1')
+        url = request.build_absolute_uri(f'/orders/{order.id}/check_pdf_status/?task_id={result.id}')
+        return Response({
+            'message': "package is building",
+            'task_id': result.id,
+            'check_pdf_status': url,
+            'events': request.build_absolute_uri(reverse('task-events', kwargs={'task_id': result.id})),
+            })
+
+    @action(detail=True, methods=['get'], permission_classes = [IsAuthenticated, IsOwnerOrStaff])
+    def package(self, request, pk=None):
+        """Скачивание пакета проекта (только владельцу заказа и сотрудникам)"""
+        order = self.get_object()
+        if not order.package:
+            raise NotFound('Order has no package yet.')
+        return sendfile(request, order.package, filename=f'project-{order.pk}.pdf')
+
+    @action(detail=False, methods=['get'], permission_classes = [IsAdminUser])
+    def docs_batch(self, request):
+        """Прогресс пакетной генерации договоров (админка / manage.py generate_docs)"""
+        progress = docs_batch_progress(request.query_params.get('batch_id', ''))
+        if progress is None:
+            raise NotFound('Batch not found.')
+        return Response(progress)
+
     @action(detail=True, methods=['get'], permission_classes = [AllowAny])
     def check_pdf_status(self, request, pk=None):
         task_id = request.query_params.get('task_id')
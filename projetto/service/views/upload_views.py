@@ -0,0 +1,99 @@
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from rest_framework import viewsets, mixins, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError, PermissionDenied
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
+
+from service.models import UploadSession
+from service.serializers.upload_serializers import UploadSessionSerializer
+from service.uploads import UPLOAD_CHUNK_MAX_SIZE, part_name, delete_parts, attach_upload
+from app.sendfile import protected_storage
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    Докачиваемая загрузка больших файлов:
+    POST /uploads/ - создать сессию, PUT /uploads/{id}/?offset=N - кусок с позиции N (сырое тело запроса),
+    GET /uploads/{id}/ - сколько уже получено, POST /uploads/{id}/complete/ - собрать файл и прикрепить к объекту.
+    """
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    permission_classes = [AllowAny]
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user if self.request.user.is_authenticated else None)
+
+    def check_session_owner(self, session):
+        # Дописывать и завершать чужую загрузку нельзя; анонимная сессия доступна по её id
+        if session.user_id is not None and session.user_id != self.request.user.pk:
+            raise PermissionDenied()
+
+    @swagger_auto_schema(manual_parameters=[
+        openapi.Parameter('offset', openapi.IN_QUERY, description="Позиция куска в файле", type=openapi.TYPE_INTEGER),
+    ])
+    def update(self, request, *args, **kwargs):
+        """Принимает очередной кусок файла"""
+        session = self.get_object()
+        self.check_session_owner(session)
+        if session.status != 'active':
+            raise ParseError('Upload is already complete.')
+
+        offset = request.query_params.get('offset', '')
+        if not offset.isdigit():
+            raise ParseError('offset query param is required.')
+        # Куски принимаются строго по порядку, клиент узнаёт позицию через GET
+        if int(offset) != session.offset:
+            return Response({'offset': session.offset}, status=status.HTTP_409_CONFLICT)
+
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        if not 0 < length <= UPLOAD_CHUNK_MAX_SIZE or session.offset + length > session.size:
+            raise ParseError(f'Chunk size must be between 1 and {UPLOAD_CHUNK_MAX_SIZE} bytes and fit the file size.')
+
+        # Тело запроса пишется в хранилище потоком, без буферизации в памяти
+        name = protected_storage.save(part_name(session, session.offset), File(request.stream))
+        if protected_storage.size(name) != length:
+            protected_storage.delete(name)
+            raise ParseError('Chunk is incomplete.')
+
+        updated = UploadSession.objects.filter(pk=session.pk, offset=session.offset, status='active') \
+                                       .update(offset=session.offset + length, parts=session.parts + [name],
+                                               updated_at=timezone.now())
+        if not updated:
+            protected_storage.delete(name)
+            session.refresh_from_db()
+            return Response({'offset': session.offset}, status=status.HTTP_409_CONFLICT)
+
+        session.refresh_from_db()
+        return Response(self.get_serializer(session).data)
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        """Собирает файл из кусков и прикрепляет к объекту"""
+        session = self.get_object()
+        self.check_session_owner(session)
+        if session.target == 'layout_pdf' and not request.user.is_staff:
+            raise PermissionDenied()
+
+        with transaction.atomic():
+            # Блокировка строки: два одновременных complete не прикрепят файл дважды
+            session = UploadSession.objects.select_for_update().get(pk=session.pk)
+            if session.status != 'active':
+                raise ParseError('Upload is already complete.')
+            if session.offset != session.size:
+                raise ParseError(f'Upload is incomplete: {session.offset} of {session.size} bytes received.')
+
+            result = attach_upload(session)
+            session.status = 'complete'
+            session.save(update_fields=['status', 'updated_at'])
+        # Куски удаляются после коммита: при откате их можно собрать заново
+        delete_parts(session)
+        return Response(result)
@@ -30,6 +30,7 @@ class UserViewSet(mixins.UpdateModelMixin,
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    cursor_ordering = 'id'
     
     def get_serializer_class(self):
         if self.action == 'create':